@@ -0,0 +1,433 @@
+"""Benchmarks for the data loaders and pane rendering.
+
+Run from the repo root:
+
+    python benchmarks.py                       # micro-benchmarks, printed
+    python benchmarks.py suite [--scale medium] [--out results.json]
+    python benchmarks.py compare old.json new.json
+
+The suite times loading, every getter and every pane spec on synthetic Apple,
+Google and JHU files of a given scale (regions x days), records peak traced
+memory for each, and writes the results as JSON (by default under
+data/benchmarks/) so runs can be compared over time.
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import timeit
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import altair as alt
+
+import memo
+from data_loader import AppleDataLoader, GoogleDataLoader, CaseDataLoader, add_new_cases, STARTUP_LEVELS
+from plots import country_spec, state_spec, county_spec, state_comp_spec
+from regions import RegionStore
+
+RESULTS_DIR = 'data/benchmarks'
+
+# synthetic data sizes for the suite: US states, counties per state, days
+SCALES = {
+    'small': {'states': 10, 'counties': 10, 'days': 60},
+    'medium': {'states': 55, 'counties': 60, 'days': 365},
+    'large': {'states': 55, 'counties': 60, 'days': 1095},
+}
+
+
+def time_per_call(fn, number = 200):
+    """Returns mean seconds per call of fn over `number` calls."""
+    return timeit.timeit(fn, number = number) / number
+
+
+def time_and_peak(fn):
+    """Returns (seconds, peak traced MB) for a single call of fn."""
+    tracemalloc.start()
+    t = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - t
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak / 2**20
+
+
+def make_apple_csv(path, states = 55, counties = 60, cities = 5, countries = 20, days = 130, seed = 0):
+    """Writes a synthetic applemobilitytrends CSV: the US and `countries - 1`
+    other countries, US states 'State i' with counties 'County j County'
+    (driving only) and cities, and one column per day."""
+    rng = np.random.default_rng(seed)
+    modes = ['driving', 'transit', 'walking']
+    names = [f'State {i}' for i in range(states)]
+
+    rows = [('country/region', 'United States', m, np.nan, np.nan) for m in modes]
+    rows += [('country/region', f'Country {i}', m, np.nan, np.nan) for i in range(1, countries) for m in modes]
+    rows += [('sub-region', s, 'driving', np.nan, 'United States') for s in names]
+    rows += [('county', f'County {j} County', 'driving', s, 'United States')
+             for s in names for j in range(counties)]
+    rows += [('city', f'City {s} {k}', m, s, 'United States')
+             for s in names for k in range(cities) for m in modes]
+    df = pd.DataFrame(rows, columns = ['geo_type', 'region', 'transportation_type', 'sub-region', 'country'])
+    df.insert(3, 'alternative_name', np.nan)
+
+    dates = pd.date_range('2020-01-13', periods = days).strftime('%Y-%m-%d')
+    volume = 100 + np.cumsum(rng.normal(0, 3, (len(df), days)), axis = 1)
+    volume[:, 0] = 100
+    pd.concat([df, pd.DataFrame(volume.round(2), columns = dates)], axis = 1).to_csv(path, index = False)
+
+
+def make_google_csv(path, countries = 80, regions = 100, days = 150, seed = 0, names = None, counties = 0):
+    """Writes a synthetic Global_Mobility_Report.csv with one US and
+    `countries - 1` other countries, each with `regions` sub-regions.
+    `names`, if given, replaces the generated US sub-region names; each US
+    sub-region gets `counties` sub-region 2 rows named 'County j County'."""
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2020-02-15', periods = days).strftime('%Y-%m-%d')
+    codes = ['US'] + [f'C{i}' for i in range(1, countries)]
+    metrics = ['retail_and_recreation', 'grocery_and_pharmacy', 'parks',
+               'transit_stations', 'workplaces', 'residential']
+
+    frames = []
+    for code in codes:
+        sub1 = [f'{code} Region {i}' for i in range(regions)]
+        if code == 'US' and names is not None:
+            sub1 = list(names)
+        pairs = [(np.nan, np.nan)] + [(r, np.nan) for r in sub1]
+        if code == 'US':
+            pairs += [(r, f'County {j} County') for r in sub1 for j in range(counties)]
+        n = len(pairs) * days
+        df = pd.DataFrame({
+            'country_region_code': code,
+            'country_region': f'Country {code}',
+            'sub_region_1': np.repeat([p[0] for p in pairs], days),
+            'sub_region_2': np.repeat([p[1] for p in pairs], days),
+            'date': np.tile(dates, len(pairs)),
+        })
+        for m in metrics:
+            df[m + '_percent_change_from_baseline'] = rng.integers(-80, 80, n)
+        frames.append(df)
+    pd.concat(frames).to_csv(path, index = False)
+
+
+def make_jhu_csv(path, states = 55, counties = 60, days = 400, seed = 0, names = None):
+    """Writes a synthetic time_series_covid19_confirmed_US.csv with
+    `states` x `counties` county rows and `days` cumulative case columns.
+    `names`, if given, replaces the generated state names."""
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2020-01-22', periods = days)
+    names = [f'State {i}' for i in range(states)] if names is None else list(names)
+    states = len(names)
+    n = states * counties
+    state = np.repeat(names, counties)
+    county = np.tile([f'County {j}' for j in range(counties)], states)
+    df = pd.DataFrame({
+        'UID': 84000000 + np.arange(n),
+        'iso2': 'US', 'iso3': 'USA', 'code3': 840,
+        'FIPS': (np.repeat(np.arange(states), counties) + 1) * 1000 + np.tile(np.arange(counties), states) + 1.0,
+        'Admin2': county,
+        'Province_State': state,
+        'Country_Region': 'US',
+        'Lat': 0.0, 'Long_': 0.0,
+        'Combined_Key': [f'{c}, {s}, US' for c, s in zip(county, state)],
+    })
+    cases = np.cumsum(rng.poisson(5, (n, days)), axis = 1)
+    wide = pd.DataFrame(cases, columns = [f'{d.month}/{d.day}/{d.year % 100}' for d in dates])
+    pd.concat([df, wide], axis = 1).to_csv(path, index = False)
+
+
+def scan_state(df, state):
+    return df[df['state'] == state]
+
+
+def scan_county(df, state, county):
+    return df[(df['state'] == state) & (df['county'] == county)]
+
+
+def bench_lookups():
+    a = AppleDataLoader()
+    state = 'Maryland'
+    state_county = ('Virginia', 'Fairfax County')
+
+    # the getters are memoized: (index) times the region-index slice itself,
+    # bypassing the shared cache, and (cached) a cache hit
+    rows = [
+        ('apple state (scan)', time_per_call(lambda: scan_state(a.states, state))),
+        ('apple state (index)', time_per_call(lambda: AppleDataLoader.get_state.__wrapped__(a, state))),
+        ('apple state (cached)', time_per_call(lambda: a.get_state(state))),
+        ('apple county (scan)', time_per_call(lambda: scan_county(a.counties, *state_county))),
+        ('apple county (index)', time_per_call(lambda: AppleDataLoader.get_county.__wrapped__(a, *state_county))),
+        ('apple county (cached)', time_per_call(lambda: a.get_county(*state_county))),
+    ]
+    for name, t in rows:
+        print(f'{name:<24} {t * 1e6:10.1f} us')
+
+
+def bench_google_ingest():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'google.csv')
+        make_google_csv(path)
+
+        def read_all():
+            google = pd.read_csv(path, low_memory = False)
+            return google[google.country_region_code == 'US']
+
+        rows = [
+            ('google read all + filter', time_and_peak(read_all)),
+            ('google streamed US-only', time_and_peak(
+                lambda: GoogleDataLoader(path, cache_dir = None).all_data)),
+        ]
+        print(f'synthetic file: {os.path.getsize(path) / 2**20:.0f} MB')
+        for name, (t, peak) in rows:
+            print(f'{name:<24} {t:8.2f} s {peak:8.0f} MB peak')
+
+
+def bench_new_cases():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'jhu.csv')
+        make_jhu_csv(path)
+        data = CaseDataLoader(path, cache_dir = None).data
+        keys = ['Province_State', 'Admin2']
+
+        def per_row_lambda():
+            return (data.groupby(keys, observed = True)['cases']
+                    .rolling(window = 2).apply(lambda x: x[1] - x[0], raw = True))
+
+        rows = [
+            ('new cases (rolling lambda)', time_per_call(per_row_lambda, number = 1)),
+            ('new cases (vectorized)', time_per_call(
+                lambda: add_new_cases(data[keys + ['cases']].copy(), keys), number = 5)),
+        ]
+        print(f'synthetic JHU: {len(data)} county-days')
+        for name, t in rows:
+            print(f'{name:<28} {t:8.3f} s')
+
+
+def bench_specs():
+    """Spec size and build time per pane, from a cold cache.
+
+    Google and JHU data are synthetic but use Apple's state names, so every
+    pane has data from all three sources."""
+    with tempfile.TemporaryDirectory() as tmp:
+        a = AppleDataLoader()
+        names = a.get_state_list()
+        make_google_csv(os.path.join(tmp, 'google.csv'), countries = 1, names = names)
+        make_jhu_csv(os.path.join(tmp, 'jhu.csv'), counties = 1, names = names)
+        g = GoogleDataLoader(os.path.join(tmp, 'google.csv'), cache_dir = None)
+        c = CaseDataLoader(os.path.join(tmp, 'jhu.csv'), cache_dir = None)
+
+        panes = [
+            ('country', lambda r: country_spec(a, g, c, r)),
+            ('state', lambda r: state_spec('Maryland', a, g, c, r)),
+            ('county', lambda r: county_spec('Virginia', 'Fairfax County', a, g, c, r)),
+            ('state comparison', lambda r: state_comp_spec(['Maryland', 'Washington'], a, g, c, r)),
+        ]
+        for resolution in ['daily', 'weekly']:
+            for name, spec in panes:
+                def cold():
+                    memo.cache.clear()
+                    return spec(resolution)
+                build = time_per_call(cold, number = 5)
+                text = json.dumps(spec(resolution))
+                dump = time_per_call(lambda: json.dumps(spec(resolution)), number = 20)
+                print(f'{name + " " + resolution:<25} {len(text) / 1024:8.1f} kB '
+                      f'{build * 1e3:8.1f} ms build {dump * 1e3:6.2f} ms json')
+
+
+def private_mb():
+    """This process's private (unshared) memory in MB; Linux only."""
+    with open('/proc/self/smaps_rollup') as f:
+        fields = dict(line.split(':', 1) for line in f if ':' in line)
+    kb = sum(int(fields[k].split()[0]) for k in ('Private_Clean', 'Private_Dirty'))
+    return kb / 1024
+
+
+def start_worker(barrier, results, google_path, case_path, cache_dir):
+    barrier.wait()
+    t = time.perf_counter()
+    loaders = {'apple': AppleDataLoader(cache_dir = cache_dir),
+               'google': GoogleDataLoader(google_path, cache_dir = cache_dir),
+               'cases': CaseDataLoader(case_path, cache_dir = cache_dir)}
+    for source, loader in loaders.items():
+        for level in STARTUP_LEVELS[source]:
+            getattr(loader, level)
+    results.put((time.perf_counter() - t, private_mb()))
+
+
+def bench_workers(n = 4):
+    """N processes starting at once, as under `panel serve --num-procs N`."""
+    with tempfile.TemporaryDirectory() as tmp:
+        google_path, case_path = os.path.join(tmp, 'google.csv'), os.path.join(tmp, 'jhu.csv')
+        make_google_csv(google_path)
+        make_jhu_csv(case_path)
+        for start in ['cold', 'warm']:
+            barrier, results = multiprocessing.Barrier(n), multiprocessing.Queue()
+            procs = [multiprocessing.Process(target = start_worker, args = (
+                barrier, results, google_path, case_path, os.path.join(tmp, 'cache'))) for _ in range(n)]
+            for p in procs:
+                p.start()
+            rows = [results.get() for _ in procs]
+            for p in procs:
+                p.join()
+            print(f'{n} workers, {start} cache: {max(t for t, _ in rows):6.2f} s to ready, '
+                  f'{sum(m for _, m in rows) / n:6.0f} MB private per worker')
+
+
+def make_synthetic(directory, states, counties, days, seed = 0):
+    """Writes matching synthetic Apple, Google and JHU files (same state and
+    county names) to directory; returns their paths."""
+    paths = {s: os.path.join(directory, f'{s}.csv') for s in ('apple', 'google', 'cases')}
+    names = [f'State {i}' for i in range(states)]
+    make_apple_csv(paths['apple'], states, counties, days = days, seed = seed)
+    make_google_csv(paths['google'], countries = 20, regions = states, days = days, seed = seed,
+                    names = names, counties = counties)
+    make_jhu_csv(paths['cases'], counties = counties, days = days, seed = seed, names = names)
+    return paths
+
+
+def measure(fn, number = 3):
+    """Returns (mean seconds, peak traced MB) for fn, from a cold shared cache.
+
+    Times are taken without tracing; peak memory comes from one extra traced call.
+    """
+    def cold():
+        memo.cache.clear()
+        return fn()
+    seconds = time_per_call(cold, number = number)
+    peak = time_and_peak(cold)[1]
+    return seconds, peak
+
+
+def run_suite(scale = 'medium', directory = None):
+    """Times loading, getters and pane specs on synthetic data; returns result rows."""
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = directory or tmp
+        size = SCALES[scale]
+        paths = make_synthetic(directory, **size)
+        cache_dir = os.path.join(directory, 'cache')
+        classes = {'apple': AppleDataLoader, 'google': GoogleDataLoader, 'cases': CaseDataLoader}
+
+        def load(source, cache):
+            loader = classes[source](paths[source], cache_dir = cache)
+            for level in STARTUP_LEVELS[source]:
+                getattr(loader, level)
+            return loader
+
+        rows = []
+        def add(group, name, fn, number = 3):
+            seconds, peak = measure(fn, number)
+            rows.append({'group': group, 'name': name, 'seconds': seconds, 'peak_mb': peak})
+            print(f'{group:<8} {name:<36} {seconds * 1e3:10.2f} ms {peak:8.1f} MB peak')
+
+        for source in classes:
+            add('load', f'{source} (parse)', lambda: load(source, None), number = 1)
+            load(source, cache_dir)
+            add('load', f'{source} (frame cache)', lambda: load(source, cache_dir))
+
+        a, g, c = (load(s, cache_dir) for s in classes)
+        state, county = 'State 1', 'County 1 County'
+        getters = [
+            ('apple', a, [('get_country', ()), ('get_country_long', ()), ('get_state', (state,)),
+                          ('get_county', (state, county)), ('get_state_list', ()),
+                          ('get_state_county_combinations', ()), ('search_states', ('stat 1',)),
+                          ('search_counties', ('state 1, county 1',))]),
+            ('google', g, [('get_country', ()), ('get_country_long', ()), ('get_state', (state,)),
+                           ('get_state_wide', (state,)), ('get_county', (state, county)),
+                           ('get_county_wide', (state, county))]),
+            ('cases', c, [('get_country', ()), ('get_state', (state,)), ('get_county', (state, county))]),
+        ]
+        for source, loader, calls in getters:
+            for method, args in calls:
+                add('getter', f'{source}.{method}', lambda: getattr(loader, method)(*args), number = 20)
+
+        store = RegionStore(a, g, c)
+        add('load', 'regions (join)', lambda: RegionStore(a, g, c).join_states(), number = 1)
+        store.level('states')
+        for n in sorted({2, 10, size['states']}):
+            add('getter', f'RegionStore.get_states x{n}',
+                lambda: store.get_states([f'State {i}' for i in range(n)]), number = 20)
+
+        for resolution in ['daily', 'weekly']:
+            add('pane', f'country_spec {resolution}', lambda: country_spec(a, g, c, resolution))
+            add('pane', f'state_spec {resolution}', lambda: state_spec(state, a, g, c, resolution))
+            add('pane', f'county_spec {resolution}', lambda: county_spec(state, county, a, g, c, resolution))
+            add('pane', f'state_comp_spec {resolution}',
+                lambda: state_comp_spec([state, 'State 2'], a, g, c, resolution))
+            add('pane', f'state_comp_spec x10 {resolution}',
+                lambda: state_comp_spec([f'State {i}' for i in range(10)], a, g, c, resolution))
+        return rows
+
+
+def environment():
+    """Metadata stored with suite results."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output = True,
+                                text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'time': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec = 'seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'altair': alt.__version__,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def write_results(rows, scale, path = None):
+    """Writes suite rows with scale and environment metadata as JSON; returns the path."""
+    if path is None:
+        stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+        path = os.path.join(RESULTS_DIR, f'{stamp}-{scale}.json')
+    os.makedirs(os.path.dirname(path) or '.', exist_ok = True)
+    with open(path, 'w') as f:
+        json.dump({'scale': dict(SCALES[scale], name = scale), 'environment': environment(),
+                   'results': rows}, f, indent = 1)
+    return path
+
+
+def compare(old_path, new_path):
+    """Prints new vs old time and peak memory for every benchmark in both files."""
+    with open(old_path) as f:
+        old = {(r['group'], r['name']): r for r in json.load(f)['results']}
+    with open(new_path) as f:
+        new = json.load(f)['results']
+    for r in new:
+        o = old.get((r['group'], r['name']))
+        if o is None:
+            continue
+        ratio = r['seconds'] / o['seconds'] if o['seconds'] else float('nan')
+        print(f"{r['group']:<8} {r['name']:<36} {o['seconds'] * 1e3:10.2f} -> {r['seconds'] * 1e3:10.2f} ms "
+              f"({ratio:5.2f}x) {o['peak_mb']:8.1f} -> {r['peak_mb']:8.1f} MB")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest = 'command')
+    suite = commands.add_parser('suite', help = 'run the suite and write a results file')
+    suite.add_argument('--scale', choices = SCALES, default = 'medium')
+    suite.add_argument('--out', help = f'results file (default: a new file in {RESULTS_DIR})')
+    diff = commands.add_parser('compare', help = 'compare two results files')
+    diff.add_argument('old')
+    diff.add_argument('new')
+    args = parser.parse_args()
+
+    if args.command == 'suite':
+        print(f'results written to {write_results(run_suite(args.scale), args.scale, args.out)}')
+    elif args.command == 'compare':
+        compare(args.old, args.new)
+    else:
+        bench_lookups()
+        bench_google_ingest()
+        bench_new_cases()
+        bench_specs()
+        bench_workers()
@@ -1,116 +1,497 @@
+import importlib.util
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import cached_property
+
+import numpy as np
 import pandas as pd
+from pandas.api.types import union_categoricals
+
+import frame_cache
+import metrics
+import sources
+from memo import memoize
+from search import NameIndex
+
+CACHE_DIR = 'data/cache'
+
+# Google destination categories, in file order
+DESTINATIONS = [
+    'retail_recreation',
+    'grocery_pharmacy',
+    'parks',
+    'transit_stations',
+    'workplaces',
+    'residential'
+]
+
+# rows per chunk when streaming the (global) Google file
+CHUNK_ROWS = 250000
+
+# JHU county-level region keys
+COUNTY_KEYS = ['Province_State', 'Admin2']
+
+# pyarrow's CSV reader is multithreaded and releases the GIL, so sources
+# loading concurrently on threads actually parse in parallel (optional)
+CSV_ENGINE = 'pyarrow' if importlib.util.find_spec('pyarrow') else 'c'
+
+
+def sort_regions(df, keys):
+    """Stable-sorts df by the region key columns so each region's rows are contiguous."""
+    return df.sort_values(list(keys), kind = 'mergesort') if len(keys) else df
+
+
+def index_regions(df, keys):
+    """Maps each region of a frame sorted with sort_regions to its row slice.
+
+    Regions are keyed by name for a single key column or by a tuple of names for
+    several (e.g. state, county).
+    """
+    by = keys[0] if len(keys) == 1 else keys
+    positions = df.groupby(by, sort = False, observed = True).indices
+    return {k: slice(v[0], v[-1] + 1) for k, v in positions.items()}
+
+
+def compact(df):
+    """Returns df with string columns as categoricals and 64-bit numbers narrowed.
+
+    float64 becomes float32, and int64 becomes int32 where the values fit.
+    """
+    dtypes = {}
+    for col, dtype in df.dtypes.items():
+        if dtype == 'float64':
+            dtypes[col] = 'float32'
+        elif dtype == 'int64':
+            s = df[col]
+            if len(s) == 0 or (s.min() >= -2**31 and s.max() < 2**31):
+                dtypes[col] = 'int32'
+        elif dtype == object or pd.api.types.is_string_dtype(dtype):
+            dtypes[col] = 'category'
+    df = df.astype(dtypes)
+    for col in df.select_dtypes('category'):
+        df[col] = df[col].cat.remove_unused_categories()
+    return df
+
+
+def melt_long(df, id_vars, value_vars, var_name, value_name):
+    """df.melt(...) with a categorical variable column and float32 values."""
+    value_vars = list(value_vars)
+    with metrics.span('melt_seconds'):
+        res = df.melt(id_vars = id_vars, value_vars = value_vars,
+                      var_name = var_name, value_name = value_name)
+        # melt stacks value_vars in order, so the codes are known without factorizing
+        codes = np.repeat(np.arange(len(value_vars)), len(df))
+        res[var_name] = pd.Categorical.from_codes(codes, value_vars)
+        res[value_name] = res[value_name].astype('float32')
+    metrics.observe('melt_rows', len(res))
+    return res
+
+
+def frame_memory(loader, names):
+    """Returns bytes held by each of the loader's frames that is materialized."""
+    return pd.Series({
+        name: int(loader.__dict__[name].memory_usage(deep = True).sum())
+        for name in names if name in loader.__dict__
+    }, dtype = 'int64')
+
+
+def region_positions(df, keys):
+    """Returns each row's position within its region (0 for a region's first row).
+
+    df must be sorted with sort_regions; with no keys the frame is one region.
+    """
+    n = len(df)
+    row = np.arange(n)
+    new_region = np.zeros(n, dtype = bool)
+    new_region[:1] = True
+    for key in keys:
+        codes = pd.factorize(df[key])[0]
+        new_region[1:] |= codes[1:] != codes[:-1]
+    return row - np.maximum.accumulate(np.where(new_region, row, 0))
+
+
+def diff(df, column, keys = ()):
+    """Row-over-row change in column within each region (NaN on a region's first row).
+
+    Same as df.groupby(keys)[column].diff() for a frame sorted with sort_regions,
+    as a float32 array.
+    """
+    values = df[column].to_numpy(dtype = 'float64')
+    res = np.empty(len(values))
+    res[:1] = np.nan
+    res[1:] = values[1:] - values[:-1]
+    res[region_positions(df, keys) == 0] = np.nan
+    return res.astype('float32')
+
+
+def rolling_mean(df, columns, keys = (), window = 7):
+    """Trailing `window`-row mean of each column, computed separately per region.
+
+    Equivalent to df.groupby(keys)[columns].rolling(window).mean() (NaN until a
+    region has `window` rows, and wherever the window holds a NaN), but done in
+    one cumulative-sum pass over a rows x columns array for all columns and
+    regions at once. df must be sorted with sort_regions. Returns a float32
+    array aligned with df's rows.
+    """
+    values = df[list(columns)].to_numpy(dtype = 'float64')
+    n = len(values)
+    missing = np.isnan(values)
+
+    csum = np.zeros((n + 1, values.shape[1]))
+    np.cumsum(np.where(missing, 0, values), axis = 0, out = csum[1:])
+    cnan = np.zeros((n + 1, values.shape[1]), dtype = 'int64')
+    np.cumsum(missing, axis = 0, out = cnan[1:])
+
+    end = np.arange(1, n + 1)
+    start = np.maximum(end - window, 0)
+    res = (csum[end] - csum[start]) / window
+    res[(cnan[end] - cnan[start]) > 0] = np.nan
+    res[region_positions(df, keys) < window - 1] = np.nan
+    return res.astype('float32')
+
+
+def weekly(df, keys = ()):
+    """Weekly means of df's numeric columns per region, dated by the week's Monday.
+
+    Key columns are kept, other non-numeric columns are dropped. df must have a
+    'date' column.
+    """
+    keys = list(keys)
+    week = (df['date'] - pd.to_timedelta(df['date'].dt.dayofweek, unit = 'D')).rename('date')
+    values = [c for c in df.columns
+              if c not in keys and c != 'date' and pd.api.types.is_numeric_dtype(df[c])]
+    res = df.groupby([df[k] for k in keys] + [week], observed = True)[values].mean()
+    return compact(res.reset_index())
+
+
+def clip_dates(df, start, end):
+    """Rows of df dated from start through end."""
+    return df[(df['date'] >= start) & (df['date'] <= end)]
+
+
+def concat_categorical(frames):
+    """Concatenates frames, keeping categorical columns categorical.
+
+    pd.concat falls back to object dtype when the frames' categories differ, so
+    each categorical column is first re-coded onto the union of categories.
+    """
+    frames = list(frames)
+    dtypes = {}
+    for col in frames[0].select_dtypes('category'):
+        used = [f[col].cat.remove_unused_categories() for f in frames]
+        # an all-NaN chunk's (empty) categories can have another dtype, which
+        # union_categoricals rejects; they add nothing to the union anyway
+        used = [u for u in used if len(u.cat.categories)] or used[:1]
+        cats = union_categoricals(used, sort_categories = True).categories
+        dtypes[col] = pd.CategoricalDtype(cats)
+    return pd.concat([f.astype(dtypes) for f in frames], ignore_index = True)
+
+
+def append_regions(df, new, keys, derive = None, context = 8):
+    """Appends rows for later dates to a frame sorted with sort_regions.
+
+    derive(frame), if given, fills the frame's derived columns (rolling
+    averages, differences) for a region-sorted frame. It is only run on the
+    new rows plus each region's last `context` rows, so the cost scales with
+    the update rather than the full history; `context` must cover the longest
+    lookback (7-day average of a difference -> 8 rows).
+    """
+    index = df.index.name
+    if index is not None:
+        df, new = df.reset_index(), new.reset_index()
+    new = sort_regions(new, keys)
+
+    if derive is not None:
+        from_end = region_positions(df.iloc[::-1], keys)[::-1]
+        tail = df[from_end < context]
+        both = sort_regions(concat_categorical([tail.assign(_new = False), new.assign(_new = True)]), keys)
+        both = derive(both)
+        new = both[both['_new'].to_numpy()].drop('_new', axis = 1)
+
+    res = sort_regions(concat_categorical([df, new]), keys)
+    return res if index is None else res.set_index(index)
+
+
+def frames(loader, *names):
+    """The loader's frames (or region indexes) `names`, read together.
+
+    update_levels swaps a level's frame and region index in under the loader's
+    lock, so reading them under it too never pairs an old frame with a new
+    index (whose slices point at other regions' rows).
+    """
+    for name in names:
+        # built (slowly, on first use) outside the lock
+        getattr(loader, name)
+    with loader.lock:
+        return [getattr(loader, name) for name in names]
+
+
+def region_rows(loader, frame, index, key):
+    """Rows of region `key` (empty if unknown) in one of the loader's frames."""
+    df, positions = frames(loader, frame, index)
+    return df.iloc[positions.get(key, slice(0))]
+
+
+def update_levels(loader, prefix, path, new, levels):
+    """Appends new long-format rows to every materialized level of a loader.
+
+    levels maps level name -> (region keys, shape, derive, index name): shape
+    turns long rows into the level's layout and derive adds its derived columns
+    (see append_regions). Updated frames and their region indexes are swapped in
+    under the loader's lock, in one step with moving its path and version on
+    (see frames), and then written to the frame cache under the new source.
+    """
+    updated = {}
+    cached = {}
+    for name, (keys, shape, derive, index) in levels.items():
+        if name not in loader.__dict__:
+            # not materialized yet: it will be built from the new source on first use
+            continue
+        df = append_regions(loader.__dict__[name], shape(new), keys, derive)
+        updated[name] = cached[name] = df
+        if index is not None:
+            updated[index] = index_regions(df, keys)
+            cached[index] = index_frame(updated[index], keys)
+
+    with loader.lock:
+        loader.__dict__.update(updated)
+        loader.path = path
+        loader.version += 1
+
+    if loader.cache_dir is not None:
+        for name, df in cached.items():
+            frame_cache.save(loader.cache_dir, prefix + name, [path], df)
+
+
+def load_frame(name, paths, build, cache_dir = CACHE_DIR):
+    """Returns build() for the given sources, going through the on-disk frame cache.
+
+    A missing frame is built by one process at a time: others (e.g. the workers
+    of `panel serve --num-procs N`) wait for it and then attach to the cached
+    copy. The builder also switches to the cached copy, so every process maps
+    the same pages instead of holding a private frame.
+    """
+    if cache_dir is None:
+        with metrics.span('frame_build_seconds', frame = name):
+            return compact(build())
+    with metrics.span('frame_load_seconds', frame = name):
+        df = frame_cache.load(cache_dir, name, paths)
+    if df is None:
+        with frame_cache.locked(cache_dir, name):
+            df = frame_cache.load(cache_dir, name, paths)
+            if df is None:
+                with metrics.span('frame_build_seconds', frame = name):
+                    df = compact(build())
+                    frame_cache.save(cache_dir, name, paths, df)
+                cached = frame_cache.load(cache_dir, name, paths)
+                df = df if cached is None else cached
+    metrics.observe('frame_rows', len(df), frame = name)
+    return df
+
+
+def index_frame(index, keys):
+    """A region index (see index_regions) as a frame of its keys and row bounds."""
+    rows = [(k if isinstance(k, tuple) else (k,)) + (s.start, s.stop) for k, s in index.items()]
+    return pd.DataFrame(rows, columns = list(keys) + ['start', 'stop'])
+
+
+def load_index(loader, name, df, keys):
+    """index_regions(df, keys), through the frame cache like the loader's frames."""
+    index = loader.load(name, lambda: index_frame(index_regions(df, keys), keys))
+    regions = [index[k].tolist() for k in keys]
+    regions = regions[0] if len(keys) == 1 else zip(*regions)
+    return {k: slice(start, stop) for k, start, stop in
+            zip(regions, index['start'].tolist(), index['stop'].tolist())}
+
 
 class AppleDataLoader():
+    """Apple mobility data.
+
+    Nothing is read on construction: the raw CSV is parsed on first use and each
+    geography level (us, states, counties, cities) is built, or loaded from the
+    frame cache, the first time it is accessed. update() appends a newer
+    release's extra dates in place.
+    """
+    cache_prefix = 'apple/'
+    
+    def __init__(self, path = 'data/applemobilitytrends-2020-05-24.csv', cache_dir = CACHE_DIR):
+        self.path = path
+        self.cache_dir = cache_dir
+        # bumped whenever the data changes; part of every memoized result's key
+        self.version = 0
+        # held while update() swaps in new frames (see frames)
+        self.lock = threading.Lock()
+    
+    def load(self, name, build):
+        """Returns frame `name`, from the frame cache if present, else build()."""
+        return load_frame(self.cache_prefix + name, [self.path], build, self.cache_dir)
+    
+    @cached_property
+    def all_data(self):
+        """Full US dataset in long format."""
+        return self.load('all_data', lambda: self.parse(self.path))
+    
+    @cached_property
+    def us(self):
+        return self.load('us', lambda: self.shape_us(self.all_data))
+    
+    @cached_property
+    def states(self):
+        return self.load('states', lambda: self.derive_states(self.shape_states(self.all_data)))
+    
+    @cached_property
+    def counties(self):
+        return self.load('counties', lambda: self.derive_counties(self.shape_counties(self.all_data)))
+    
+    @cached_property
+    def cities(self):
+        return self.load('cities', lambda: self.derive_cities(self.shape_cities(self.all_data)))
+    
+    @cached_property
+    def state_index(self):
+        return load_index(self, 'state_index', self.states, ['state'])
+    
+    @cached_property
+    def county_index(self):
+        return load_index(self, 'county_index', self.counties, ['state', 'county'])
     
-    def __init__(self):
-        apple = pd.read_csv('data/applemobilitytrends-2020-05-24.csv')
+    def memory_usage(self):
+        """Returns bytes held by each materialized frame."""
+        return frame_memory(self, ['all_data', 'us', 'states', 'counties', 'cities'])
+    
+    def parse(self, path, after = None):
+        """Parses a raw CSV, keeping US rows and melting dates (after `after`, if
+        given) from wide to long."""
+        apple = pd.read_csv(path, engine = CSV_ENGINE)
         
         # filtering to US only
-        apple_us = apple[(apple.country == 'United States') | (apple.region == 'United States')]
+        apple_us = compact(apple[(apple.country == 'United States') | (apple.region == 'United States')])
         
         # date cols to melt for apple data
-        cols_to_melt = apple_us.columns.str.startswith('2020')
+        date_cols = apple_us.columns[apple_us.columns.str.match(r'\d{4}-\d{2}-\d{2}$')]
+        if after is not None:
+            date_cols = date_cols[pd.to_datetime(date_cols) > after]
 
         # pivoting dates from wide to long
         apple_clean = apple_us.melt(
             id_vars = ['geo_type', 'region', 'sub-region', 'country', 'transportation_type'], 
-            value_vars = apple_us.columns[cols_to_melt],
+            value_vars = date_cols,
             var_name = 'date', 
             value_name = 'relative_vol'
         )
+        apple_clean['date'] = pd.to_datetime(apple_clean['date'], format = '%Y-%m-%d')
         
-        # full dataset
-        self.all_data = apple_clean 
-        
-        # us-wide data
+        return apple_clean
+    
+    # Each level is shaped from long-format rows and then gets its derived
+    # (rolling average) columns; update() reuses both on just the new dates.
+    
+    def shape_us(self, apple_clean):
+        """US-wide data."""
         us = pd.DataFrame(apple_clean[apple_clean.geo_type == 'country/region'])
-        us['date'] = pd.to_datetime(us['date'])
         us = us.drop(['geo_type', 'region', 'sub-region', 'country'], axis = 1)
-        self.us = us
-        
-        # state-wide data (driving volume + 7-day rolling average)
+        return us
+    
+    def shape_states(self, apple_clean):
+        """State-wide driving volume."""
         states = pd.DataFrame(apple_clean[apple_clean.geo_type == 'sub-region'])
-        states['date'] = pd.to_datetime(states['date'])
         temp = states.pivot_table(
             index = ['region', 'date'], 
             values = 'relative_vol', 
-            columns = 'transportation_type').reset_index()
-
-        x = temp.groupby('region')['driving'].rolling(7).mean().reset_index()
-        temp['7_day'] = x['driving']
-        temp.columns = ['state', 'date', 'driving', '7_day']
-        self.states = temp
-        
-        # county data
+            columns = 'transportation_type',
+            observed = True).reset_index()
+        temp.columns = ['state', 'date', 'driving']
+        return sort_regions(temp, ['state'])
+    
+    def derive_states(self, df):
+        df['7_day'] = rolling_mean(df, ['driving'], ['state'])[:, 0]
+        return df
+    
+    def shape_counties(self, apple_clean):
+        """County driving volume."""
         counties = pd.DataFrame(apple_clean[(apple_clean.geo_type == 'county') & 
                                             (apple_clean.transportation_type == 'driving')])
-        counties['date'] = pd.to_datetime(counties['date'])
         temp = counties.pivot_table(
             index = ['sub-region', 'region', 'date'], 
             values = 'relative_vol', 
-            columns = 'transportation_type').reset_index()
-
-        x = temp.groupby(['sub-region', 'region'])['driving'].rolling(7).mean().reset_index()
-        temp['7_day'] = x['driving']
-        temp.columns = ['state', 'county', 'date', 'driving', '7_day']
-        self.counties = temp
-        
-        # city data
+            columns = 'transportation_type',
+            observed = True).reset_index()
+        temp.columns = ['state', 'county', 'date', 'driving']
+        return sort_regions(temp, ['state', 'county'])
+    
+    def derive_counties(self, df):
+        df['7_day'] = rolling_mean(df, ['driving'], ['state', 'county'])[:, 0]
+        return df
+    
+    def shape_cities(self, apple_clean):
+        """City data, per transportation type."""
         x = pd.DataFrame(apple_clean[apple_clean.geo_type == 'city'])
         x = x.drop(['geo_type'], axis = 1)
-        x['date'] = pd.to_datetime(x['date'])
         x = x.pivot_table(
                     index = ['sub-region', 'region', 'date'], 
                     values = 'relative_vol', 
-                    columns = 'transportation_type').reset_index()
-
-        driving = x.groupby(['sub-region', 'region'])['driving', 'date'].rolling(7, on = 'date').mean().reset_index()
-        walking = x.groupby(['sub-region', 'region'])['walking', 'date'].rolling(7, on = 'date').mean().reset_index()
-        transit = x.groupby(['sub-region', 'region'])['transit', 'date'].rolling(7, on = 'date').mean().reset_index()
-        x['7_day_driving'] = driving['driving']
-        x['7_day_transit'] = walking['walking']
-        x['7_day_walking'] = walking['walking']
-
-        x.columns = ['state', 'city', 'date', 'driving', 'trasit', 'walking',
-                    '7_day_driving', '7_day_walking', '7_day_transit']
-        
-        self.cities = x
+                    columns = 'transportation_type',
+                    observed = True).reset_index()
+        x = x.reindex(columns = ['sub-region', 'region', 'date', 'driving', 'transit', 'walking'])
+        x.columns = ['state', 'city', 'date', 'driving', 'transit', 'walking']
+        return sort_regions(x, ['state', 'city'])
     
+    def derive_cities(self, df):
+        df[['7_day_driving', '7_day_transit', '7_day_walking']] = rolling_mean(
+            df, ['driving', 'transit', 'walking'], ['state', 'city'])
+        return df
     
+    def update(self, path):
+        """Appends the dates in `path`, a newer release of the Apple file, that are
+        past the loaded data. Returns True if any were added."""
+        new = self.parse(path, after = self.us['date'].max())
+        if new.empty:
+            return False
+        update_levels(self, self.cache_prefix, path, new, {
+            'all_data': ([], lambda x: x, None, None),
+            'us': ([], self.shape_us, None, None),
+            'states': (['state'], self.shape_states, self.derive_states, 'state_index'),
+            'counties': (['state', 'county'], self.shape_counties, self.derive_counties, 'county_index'),
+            'cities': (['state', 'city'], self.shape_cities, self.derive_cities, None),
+        })
+        return True
+    
+    @memoize
     def get_country(self):
         """Returns US-wide time series dataset."""
-        x = self.us.pivot_table(index = 'date', columns = 'transportation_type', values = 'relative_vol').reset_index()
-        driving = x[['driving', 'date']].rolling(7, on = 'date').mean().reset_index()
-        walking = x[['walking', 'date']].rolling(7, on = 'date').mean().reset_index()
-        transit = x[['transit', 'date']].rolling(7, on = 'date').mean().reset_index()
-        x['7_day_driving'] = driving['driving']
-        x['7_day_transit'] = walking['walking']
-        x['7_day_walking'] = walking['walking']
-        return pd.DataFrame(x)
+        x = self.us.pivot_table(index = 'date', columns = 'transportation_type', values = 'relative_vol',
+                                observed = True).reset_index()
+        x[['7_day_driving', '7_day_transit', '7_day_walking']] = rolling_mean(
+            x, ['driving', 'transit', 'walking'])
+        return compact(x)
     
+    @memoize
     def get_country_long(self):
         us = self.get_country()
-        x = us.melt(id_vars = 'date',
-             value_vars = ['7_day_driving', '7_day_transit', '7_day_walking'],
-             value_name = '7_day_average')
+        x = melt_long(us, 'date', ['7_day_driving', '7_day_transit', '7_day_walking'],
+                      'transportation_type', '7_day_average')
 
         l = {'7_day_driving':'driving', '7_day_walking':'walking', '7_day_transit':'transit'}
-        x['transportation_type'] = x['transportation_type'].apply(lambda x: l[x])
+        x['transportation_type'] = x['transportation_type'].cat.rename_categories(l)
         return x
     
+    @memoize
     def get_country_long_raw(self):
         us = self.get_country()
-        x = us.melt(id_vars = 'date',
-             value_vars = ['driving', 'transit', 'walking'],
-             value_name = 'volume')
+        x = melt_long(us, 'date', ['driving', 'transit', 'walking'],
+                      'transportation_type', 'volume')
         return x
     
+    @memoize
     def get_state(self, state):
-        return pd.DataFrame(self.states[self.states['state'] == state])
+        return region_rows(self, 'states', 'state_index', state)
     
+    @memoize
     def get_county(self, state, county):
-        res = pd.DataFrame(self.counties[(self.counties['state'] == state) &
-                                          (self.counties['county'] == county)]) 
+        res = region_rows(self, 'counties', 'county_index', (state, county))
         res = res.drop(['state', 'county'], axis = 1)
         return res
     
@@ -118,158 +499,418 @@ class AppleDataLoader():
         return pd.DataFrame(self.cities)
     
     def get_state_list(self):
-        return sorted(self.states['state'].unique())
+        return sorted(self.state_index)
     
+    @memoize
     def get_state_county_combinations(self):
-        res = []
-        for i in list(zip(self.counties.state, self.counties.county)):
-            res.append(', '.join(i))
-        return list(set(res))  
+        """'State, County' names of all counties, from the county index's keys."""
+        return [f'{state}, {county}' for state, county in self.county_index]
+
+    @memoize
+    def state_names(self):
+        return NameIndex(self.get_state_list())
+
+    @memoize
+    def county_names(self):
+        return NameIndex(self.get_state_county_combinations())
+
+    def search_states(self, query, limit = 10):
+        """State names matching query, best first (case-insensitive prefix, then fuzzy; see search)."""
+        return self.state_names().search(query, limit)
+
+    def search_counties(self, query, limit = 10):
+        """'State, County' names matching query, best first (see search_states)."""
+        return self.county_names().search(query, limit)  
 
     
 class GoogleDataLoader():
+    """Google mobility data, parsed and materialized per geography level on first use."""
+    cache_prefix = 'google/'
     
-    def __init__(self):
-        google = pd.read_csv('data/Global_Mobility_Report.csv', low_memory = False)
-        
-        # filtering to US only
-        google_us = google[google.country_region_code == 'US']
+    def __init__(self, path = 'data/Global_Mobility_Report.csv', cache_dir = CACHE_DIR):
+        self.path = path
+        self.cache_dir = cache_dir
+        # bumped whenever the data changes; part of every memoized result's key
+        self.version = 0
+        # held while update() swaps in new frames (see frames)
+        self.lock = threading.Lock()
+    
+    def load(self, name, build):
+        return load_frame(self.cache_prefix + name, [self.path], build, self.cache_dir)
+    
+    @cached_property
+    def all_data(self):
+        """Full US dataset, indexed by date."""
+        return self.load('all_data', lambda: self.parse(self.path))
+    
+    @cached_property
+    def us(self):
+        return self.load('us', lambda: self.shape_us(self.all_data))
+    
+    @cached_property
+    def states(self):
+        return self.load('states', lambda: self.derive_states(self.shape_states(self.all_data)))
+    
+    @cached_property
+    def counties(self):
+        return self.load('counties', lambda: self.shape_counties(self.all_data))
+    
+    @cached_property
+    def state_index(self):
+        return load_index(self, 'state_index', self.states, ['sub_region_1'])
+    
+    @cached_property
+    def county_index(self):
+        return load_index(self, 'county_index', self.counties, ['sub_region_1', 'sub_region_2'])
+    
+    def memory_usage(self):
+        """Returns bytes held by each materialized frame."""
+        return frame_memory(self, ['all_data', 'us', 'states', 'counties'])
+    
+    def parse(self, path, after = None):
+        """Streams a raw (global) CSV in chunks, keeping US rows (dated after
+        `after`, if given).
+
+        Only the region, date and metric columns are read, with region names as
+        categoricals and metrics as float32, so peak memory is one chunk plus
+        the US rows rather than the whole world's data as object columns.
+        """
+        id_cols = ['country_region_code', 'country_region', 'sub_region_1', 'sub_region_2', 'date']
+        dtypes = {c: 'category' for c in id_cols[:4]}
+        dtypes['date'] = str
+        reader = pd.read_csv(
+            path,
+            usecols = lambda c: c in id_cols or c.endswith('_percent_change_from_baseline'),
+            dtype = dtypes,
+            chunksize = CHUNK_ROWS
+        )
         
-        google_clean = google_us.drop('country_region_code', 1)
-        google_clean.date = pd.to_datetime(google_clean.date)
-        google_clean.columns = [
-            'country_region',
-            'sub_region_1',
-            'sub_region_2', 
-            'date',
-            'retail_recreation',
-            'grocery_pharmacy',
-            'parks',
-            'transit_stations',
-            'workplaces',
-            'residential'
-        ]
-
-        google_clean = google_clean.set_index('date')
+        # filtering to US only (ISO dates compare correctly as strings)
+        after = None if after is None else after.strftime('%Y-%m-%d')
+        chunks = [chunk[(chunk.country_region_code == 'US') &
+                        (True if after is None else chunk.date > after)] for chunk in reader]
+        google_us = concat_categorical(chunks)
         
-        # full dataset
-        self.all_data = google_clean
+        google_clean = google_us.drop('country_region_code', axis = 1)
+        google_clean.date = pd.to_datetime(google_clean.date, format = '%Y-%m-%d')
+        values = google_clean.columns[4:]
+        google_clean[values] = google_clean[values].astype('float32')
+        google_clean.columns = ['country_region', 'sub_region_1', 'sub_region_2', 'date'] + DESTINATIONS
 
-        # US-wide data
+        return google_clean.set_index('date')
+    
+    def shape_us(self, google_clean):
+        """US-wide data."""
         us = google_clean[google_clean.sub_region_1.isna()]
-        us = us.drop(['country_region', 'sub_region_1', 'sub_region_2'], axis = 1)
-        self.us = us
-        
-        # state-wide data
+        return us.drop(['country_region', 'sub_region_1', 'sub_region_2'], axis = 1)
+    
+    def shape_states(self, google_clean):
+        """State-wide data."""
         states = google_clean[google_clean.sub_region_2.isna() & (~google_clean.sub_region_1.isna())]
         states = states.drop(['country_region', 'sub_region_2'], axis = 1)
-        
+        return sort_regions(states.reset_index(), ['sub_region_1'])
+    
+    def derive_states(self, df):
         # computing 7-day moving averages for each destination category
-        x = states.reset_index()
-        rr = x.groupby('sub_region_1')['retail_recreation', 'date'].rolling(7, on = 'date').mean().reset_index()
-        gp = x.groupby('sub_region_1')['grocery_pharmacy', 'date'].rolling(7, on = 'date').mean().reset_index()
-        parks = x.groupby('sub_region_1')['parks', 'date'].rolling(7, on = 'date').mean().reset_index()
-        transit = x.groupby('sub_region_1')['transit_stations', 'date'].rolling(7, on = 'date').mean().reset_index()
-        work = x.groupby('sub_region_1')['workplaces', 'date'].rolling(7, on = 'date').mean().reset_index()
-        resi = x.groupby('sub_region_1')['residential', 'date'].rolling(7, on = 'date').mean().reset_index()
-        x['retail_recreation_7_day']= rr['retail_recreation']
-        x['grocery_pharmacy_7_day']= gp['grocery_pharmacy']
-        x['parks_7_day']= parks['parks']
-        x['transit_stations_7_day']= transit['transit_stations']
-        x['workplaces_7_day']= work['workplaces']
-        x['residential_7_day'] = resi['residential']
-        self.states = x
-        
-        # county data
+        df[[c + '_7_day' for c in DESTINATIONS]] = rolling_mean(df, DESTINATIONS, ['sub_region_1'])
+        return df
+    
+    def shape_counties(self, google_clean):
+        """County data."""
         counties = google_clean[~google_clean.sub_region_2.isna() & (~google_clean.sub_region_1.isna())]
         counties = counties.drop('country_region', axis = 1)
-        self.counties = counties
-
+        return sort_regions(counties, ['sub_region_1', 'sub_region_2'])
+    
+    def update(self, path):
+        """Appends the rows in `path`, a newer release of the Google file, dated
+        past the loaded data. Returns True if any were added."""
+        new = self.parse(path, after = self.us.index.max())
+        if new.empty:
+            return False
+        update_levels(self, self.cache_prefix, path, new, {
+            'all_data': ([], lambda x: x, None, None),
+            'us': ([], self.shape_us, None, None),
+            'states': (['sub_region_1'], self.shape_states, self.derive_states, 'state_index'),
+            'counties': (['sub_region_1', 'sub_region_2'], self.shape_counties, None, 'county_index'),
+        })
+        return True
 
+    @memoize
     def get_country(self):
         """Returns US-wide time series dataset."""
         x = self.us.reset_index()
-        rr = x[['retail_recreation', 'date']].rolling(7, on = 'date').mean().reset_index()
-        gp = x[['grocery_pharmacy', 'date']].rolling(7, on = 'date').mean().reset_index()
-        parks = x[['parks', 'date']].rolling(7, on = 'date').mean().reset_index()
-        transit = x[['transit_stations', 'date']].rolling(7, on = 'date').mean().reset_index()
-        work = x[['workplaces', 'date']].rolling(7, on = 'date').mean().reset_index()
-        resi = x[['residential', 'date']].rolling(7, on = 'date').mean().reset_index()
-        x['retail_recreation_7_day']= rr['retail_recreation']
-        x['grocery_pharmacy_7_day']= gp['grocery_pharmacy']
-        x['parks_7_day']= parks['parks']
-        x['transit_stations_7_day']= transit['transit_stations']
-        x['workplaces_7_day']= work['workplaces']
-        x['residential_7_day'] = resi['residential']
-        
-        return pd.DataFrame(x)
+        x[[c + '_7_day' for c in DESTINATIONS]] = rolling_mean(x, DESTINATIONS)
+        return compact(x)
     
+    @memoize
     def get_country_long(self):
         x = self.get_country()
         v = x.columns[1:7]
-        res = x.melt(
-            id_vars = 'date',
-            value_vars = v,
-            var_name = 'destination_type',
-            value_name = 'volume'
-        )
+        res = melt_long(x, 'date', v, 'destination_type', 'volume')
         return res
 
         
+    @memoize
     def get_state(self, state):
         """Returns time series data for given state."""
-        res = pd.DataFrame(self.states[self.states.sub_region_1 == state])
+        res = region_rows(self, 'states', 'state_index', state)
         v = res.columns[2:8]
-        res = res.melt(id_vars = ['sub_region_1','date'],
-                         value_vars = v,
-                         var_name = 'destination_type',
-                         value_name = 'volume')
+        res = melt_long(res, ['sub_region_1', 'date'], v, 'destination_type', 'volume')
         return res
 
+    @memoize
     def get_county(self, state, county):
         """Returns time series data for given state, county pair"""
-        res = pd.DataFrame(self.counties[(self.counties.sub_region_1 == state) &
-                                       (self.counties.sub_region_2 == county)])
+        res = region_rows(self, 'counties', 'county_index', (state, county))
         
         v = res.columns[2:8]
-        res = res.reset_index().melt(id_vars = 'date',
-                         value_vars = v,
-                         var_name = 'destination_type',
-                         value_name = 'volume')
+        res = melt_long(res.reset_index(), 'date', v, 'destination_type', 'volume')
         
         return res
+
+    @memoize
+    def get_state_wide(self, state):
+        """Returns time series data for given state, one column per destination."""
+        return region_rows(self, 'states', 'state_index', state)
+
+    @memoize
+    def get_county_wide(self, state, county):
+        """Returns time series data for given state, county pair, one column per destination."""
+        return region_rows(self, 'counties', 'county_index', (state, county)).reset_index()
     
     
+def add_new_cases(df, keys = ()):
+    """Adds daily new cases and their 7-day average to a frame sorted by region and date."""
+    df['new_cases'] = diff(df, 'cases', keys)
+    df['new_cases_7_day'] = rolling_mean(df, ['new_cases'], keys)[:, 0]
+    return df
+
+
 class CaseDataLoader():
+    """JHU confirmed case counts, parsed and materialized per level on first use.
+
+    Daily new cases (and their 7-day average) are computed for every county,
+    state and the country when each level is built, so getters are lookups.
+    """
+    cache_prefix = 'cases/'
+    
+    def __init__(self, path = sources.jhu, cache_dir = CACHE_DIR):
+        # a file path or URL, or a SnapshotSource to read its newest local
+        # snapshot (by default the JHU one, fetched only if none is stored yet)
+        self.source = path if isinstance(path, sources.SnapshotSource) else None
+        self.path = getattr(path, 'path', path)
+        # newest snapshot refresh() has read, even if it added no dates
+        self.checked = self.path
+        self.cache_dir = cache_dir
+        # bumped whenever the data changes; part of every memoized result's key
+        self.version = 0
+        # held while update() swaps in new frames (see frames)
+        self.lock = threading.Lock()
+    
+    def load(self, name, build):
+        return load_frame(self.cache_prefix + name, [self.path], build, self.cache_dir)
+    
+    @cached_property
+    def data(self):
+        """County-level case counts in long format."""
+        return self.load('data', lambda: add_new_cases(self.parse(self.path), COUNTY_KEYS))
+    
+    @cached_property
+    def states(self):
+        return self.load('states', lambda: add_new_cases(self.shape_states(self.data), ['Province_State']))
+    
+    @cached_property
+    def us(self):
+        return self.load('us', lambda: add_new_cases(self.shape_us(self.data)))
+    
+    @cached_property
+    def state_index(self):
+        return load_index(self, 'state_index', self.states, ['Province_State'])
+    
+    @cached_property
+    def county_index(self):
+        return load_index(self, 'county_index', self.data, COUNTY_KEYS)
+    
+    def memory_usage(self):
+        """Returns bytes held by each materialized frame."""
+        return frame_memory(self, ['data', 'states', 'us'])
     
-    def __init__(self):
-        raw = pd.read_csv('https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_confirmed_US.csv')
+    def parse(self, path, after = None):
+        """Parses a raw CSV and melts dates (after `after`, if given) from wide to long."""
+        raw = pd.read_csv(path, engine = CSV_ENGINE)
+        # county FIPS codes (0 where missing) are kept for regions.RegionStore;
+        # converted before compact() so float32 cannot round codes above 2**24
+        raw['FIPS'] = raw['FIPS'].fillna(0).astype('int64')
+        raw = compact(raw)
         id_vars = raw.columns[1:11]
         value_cars = raw.columns[11:]
+        if after is not None:
+            value_cars = value_cars[pd.to_datetime(value_cars, format = '%m/%d/%y') > after]
         temp = raw.melt(id_vars = id_vars, value_vars = value_cars, var_name = 'date', value_name = 'cases')
-        temp['date'] = pd.to_datetime(temp['date'])
+        temp['date'] = pd.to_datetime(temp['date'], format = '%m/%d/%y')
         temp = temp[temp.Country_Region == "US"]
-        temp = temp.drop(['iso2', 'iso3', 'code3', 'FIPS', 'Lat', 'Long_', 'Combined_Key'], axis = 1)
-        
-        self.data = temp
-        
-        # state data
-        self.states = temp.groupby(['Province_State', 'date'])['cases'].sum().reset_index()
+        temp = temp.drop(['iso2', 'iso3', 'code3', 'Lat', 'Long_', 'Combined_Key'], axis = 1)
         
+        return sort_regions(temp, COUNTY_KEYS)
+    
+    def shape_states(self, data):
+        """State totals."""
+        states = data.groupby(['Province_State', 'date'], observed = True)['cases'].sum().reset_index()
+        return sort_regions(states, ['Province_State'])
+    
+    def shape_us(self, data):
+        """US totals."""
+        return data.groupby(['Country_Region', 'date'], observed = True)['cases'].sum().reset_index()
+    
+    def update(self, path):
+        """Appends the dates in `path`, a newer release of the JHU file, that are
+        past the loaded data. Returns True if any were added."""
+        new = self.parse(path, after = self.us['date'].max())
+        if new.empty:
+            return False
+        update_levels(self, self.cache_prefix, path, new, {
+            'data': (COUNTY_KEYS, lambda x: x, lambda x: add_new_cases(x, COUNTY_KEYS), 'county_index'),
+            'states': (['Province_State'], self.shape_states,
+                       lambda x: add_new_cases(x, ['Province_State']), 'state_index'),
+            'us': ([], self.shape_us, add_new_cases, None),
+        })
+        return True
+    
+    def refresh(self):
+        """Fetches a newer snapshot, if the source has one, and appends its new dates.
+
+        Returns True if the data changed.
+        """
+        if self.source is None:
+            return False
+        path = self.source.refresh()
+        if path == self.checked:
+            return False
+        # a snapshot with revisions only adds no dates (and leaves self.path on
+        # the old file): remember it so later calls do not parse it again
+        changed = self.update(path)
+        self.checked = path
+        return changed
+    
     def get_country(self):
-        us = self.data.groupby(['Country_Region', 'date'])['cases'].sum().reset_index()
-        us['new_cases'] = us['cases'].rolling(window=2).apply(lambda x: x[1] - x[0], raw = True)
-        return us
+        return self.us
 
     def get_state(self, state):
-        res = pd.DataFrame(self.states[self.states.Province_State == state])
-        res['new_cases'] = res['cases'].rolling(window=2).apply(lambda x: x[1] - x[0], raw = True)
-        return res
+        return region_rows(self, 'states', 'state_index', state)
     
     def get_county(self, state, county):
         x = (county.split(' ')[:-1])
         c = ' '.join(x)
         
-        res = pd.DataFrame(self.data[(self.data.Province_State == state) & (self.data.Admin2 == c)])
-        res['new_cases'] = res['cases'].rolling(window=2).apply(lambda x: x[1] - x[0], raw = True)
-        return res
\ No newline at end of file
+        return region_rows(self, 'data', 'county_index', (state, c))
+
+
+def refresh_periodically(loader, period = 60 * 60):
+    """Calls loader.refresh() every `period` seconds on a daemon thread.
+
+    One thread per loader however many sessions share it, and off any event
+    loop, so a refresh's download and parse block no session. Failures (e.g.
+    while offline) are printed and retried the next period. Returns an Event;
+    set it to stop.
+    """
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(period):
+            try:
+                loader.refresh()
+            except Exception as e:
+                print(f'{type(loader).__name__} refresh failed: {e}')
+
+    threading.Thread(target = run, name = 'refresh', daemon = True).start()
+    return stop
+
+
+# start method of load_concurrently's build workers: forking a threaded server
+# process can copy locks held by other threads (pandas, pyarrow) into the child
+START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+# Frames materialized by load_concurrently, in order. Country-level frames come
+# first so the Country tab can render before state and county frames are ready.
+STARTUP_LEVELS = {
+    'apple': ['us', 'states', 'counties', 'state_index', 'county_index'],
+    'google': ['us', 'states', 'counties', 'state_index', 'county_index'],
+    'cases': ['data', 'us', 'states', 'state_index', 'county_index'],
+}
+
+
+def frames_cached(loader, names):
+    """True if all of the loader's frames `names` are in the frame cache."""
+    return loader.cache_dir is not None and all(
+        frame_cache.contains(loader.cache_dir, loader.cache_prefix + name, [loader.path]) for name in names)
+
+
+def build_frames(factory, levels):
+    """Builds a loader's frames (in a worker process) so they land in the frame cache."""
+    loader = factory()
+    for level in levels:
+        getattr(loader, level)
+
+
+def load_concurrently(factories = None, levels = STARTUP_LEVELS, processes = (os.cpu_count() or 1) > 1):
+    """Constructs the loaders and materializes their startup frames, one thread per source.
+
+    factories maps a source name to a callable returning its loader (by default
+    the three loader classes; constructing CaseDataLoader may fetch a snapshot).
+    With processes, a loader whose frames are not cached yet has them built in
+    a worker process first (much of the parsing holds the GIL), and the thread
+    then only memory-maps them from the frame cache; factories must then be
+    picklable. Workers are started with START_METHOD, never forked.
+
+    Returns (futures, timings) immediately. futures[source] resolves to the
+    loader once all its levels are built, and futures[source, level] as soon as
+    that frame is. timings[source, level] and timings[source] are filled in
+    with seconds since the start as each finishes.
+    """
+    if factories is None:
+        factories = {'apple': AppleDataLoader, 'google': GoogleDataLoader, 'cases': CaseDataLoader}
+    futures = {}
+    for source in factories:
+        futures[source] = Future()
+        for level in levels.get(source, []):
+            futures[source, level] = Future()
+    timings = {}
+    start = time.perf_counter()
+
+    def run(source):
+        pending = [futures[source]] + [futures[source, level] for level in levels.get(source, [])]
+        try:
+            loader = factories[source]()
+            frames = [l for l in levels.get(source, []) if not l.endswith('_index')]
+            if processes and loader.cache_dir is not None and not frames_cached(loader, frames):
+                with ProcessPoolExecutor(1, mp_context = multiprocessing.get_context(START_METHOD)) as worker:
+                    worker.submit(build_frames, factories[source], frames).result()
+            for level in levels.get(source, []):
+                getattr(loader, level)
+                timings[source, level] = time.perf_counter() - start
+                futures[source, level].set_result(loader)
+            timings[source] = time.perf_counter() - start
+            futures[source].set_result(loader)
+        except Exception as e:
+            for future in pending:
+                if not future.done():
+                    future.set_exception(e)
+
+    pool = ThreadPoolExecutor(len(factories), thread_name_prefix = 'load')
+    for source in factories:
+        pool.submit(run, source)
+    pool.shutdown(wait = False)
+    return futures, timings
+
+
+def format_timings(timings, sources = None):
+    """One line per finished source (or only `sources`): total seconds, then
+    each level's finish time."""
+    # a copy, as loading threads may still be adding to timings
+    timings = dict(timings)
+    lines = []
+    for source in [k for k in timings if isinstance(k, str) and (sources is None or k in sources)]:
+        levels = ', '.join(f'{k[1]} {t:.2f}' for k, t in timings.items()
+                           if isinstance(k, tuple) and k[0] == source)
+        lines.append(f'{source:<8} {timings[source]:6.2f} s ({levels})')
+    return '\n'.join(lines)
@@ -0,0 +1,141 @@
+"""On-disk cache of preprocessed loader frames.
+
+Each frame is stored as a directory of .npy files, one per column, so a warm
+start memory-maps already-shaped arrays instead of re-parsing the raw CSVs.
+String columns are stored as integer codes plus a list of labels. Entries are
+keyed on the source files' path, size and modification time, so replacing a
+source file invalidates its cache automatically.
+
+Numeric columns are memory-mapped read-only, so processes loading the same
+entry share its pages through the OS page cache rather than each holding a
+copy; locked() lets one process build a missing entry while others wait.
+"""
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows: concurrent builds are then not deduplicated
+    fcntl = None
+
+import numpy as np
+import pandas as pd
+
+# bump whenever loader preprocessing changes shape or meaning of cached frames
+CACHE_VERSION = 8
+
+
+def source_key(paths):
+    """Returns a cache key for the given source files, or None if any is not a local file."""
+    h = hashlib.sha1(str(CACHE_VERSION).encode())
+    for path in paths:
+        if not os.path.isfile(path):
+            return None
+        st = os.stat(path)
+        h.update(f'{os.path.abspath(path)}|{st.st_size}|{st.st_mtime_ns}'.encode())
+    return h.hexdigest()[:16]
+
+
+def save_frame(directory, df):
+    """Writes df to directory as one .npy file per column plus meta.json."""
+    # unnamed indexes are positional leftovers from filtering/sorting and are dropped
+    index = df.index.name
+    df = df.reset_index(drop = index is None)
+
+    columns = []
+    for i, col in enumerate(df.columns):
+        s = df[col]
+        fname = f'{i}.npy'
+        meta = {'name': col, 'file': fname}
+        if isinstance(s.dtype, pd.CategoricalDtype) or not (
+                pd.api.types.is_numeric_dtype(s) or pd.api.types.is_datetime64_any_dtype(s)):
+            cat = s.astype('category').cat
+            meta['dtype'] = str(s.dtype)
+            meta['categories'] = cat.categories.tolist()
+            np.save(os.path.join(directory, fname), cat.codes.to_numpy())
+        else:
+            np.save(os.path.join(directory, fname), s.to_numpy())
+        columns.append(meta)
+
+    with open(os.path.join(directory, 'meta.json'), 'w') as f:
+        json.dump({'columns': columns, 'index': index, 'length': len(df)}, f)
+
+
+def load_frame(directory):
+    """Reads a frame written by save_frame, memory-mapping numeric columns."""
+    with open(os.path.join(directory, 'meta.json')) as f:
+        meta = json.load(f)
+
+    data = {}
+    for col in meta['columns']:
+        arr = np.load(os.path.join(directory, col['file']), mmap_mode = 'r')
+        if 'categories' in col:
+            arr = pd.Categorical.from_codes(arr, col['categories'])
+            if col['dtype'] != 'category':
+                arr = arr.astype(col['dtype'])
+        # wrapping each column in a Series keeps pandas from consolidating
+        # (and so copying) the memory-mapped arrays into one block
+        data[col['name']] = pd.Series(arr, copy = False)
+
+    df = pd.DataFrame(data, copy = False)
+    if meta['index'] is not None:
+        df = df.set_index(meta['index'])
+    return df
+
+
+@contextlib.contextmanager
+def locked(cache_dir, name):
+    """Holds an exclusive, cross-process lock on entry `name` while in the block."""
+    root = os.path.join(cache_dir, name)
+    os.makedirs(root, exist_ok = True)
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(root, '.lock'), 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def contains(cache_dir, name, paths):
+    """True if frame `name` built from `paths` is cached."""
+    key = source_key(paths)
+    return key is not None and os.path.isfile(os.path.join(cache_dir, name, key, 'meta.json'))
+
+
+def load(cache_dir, name, paths):
+    """Returns the cached frame `name` built from `paths`, or None on a miss."""
+    if not contains(cache_dir, name, paths):
+        return None
+    return load_frame(os.path.join(cache_dir, name, source_key(paths)))
+
+
+def save(cache_dir, name, paths, df):
+    """Stores frame `name` built from `paths`, replacing stale entries."""
+    key = source_key(paths)
+    if key is None:
+        return
+    root = os.path.join(cache_dir, name)
+    os.makedirs(root, exist_ok = True)
+
+    # write to a scratch dir and rename so readers never see a partial entry
+    tmp = tempfile.mkdtemp(dir = root, prefix = '.tmp-')
+    save_frame(tmp, df)
+
+    entry = os.path.join(root, key)
+    try:
+        os.rename(tmp, entry)
+    except OSError:
+        # another process got there first
+        shutil.rmtree(tmp, ignore_errors = True)
+
+    for old in os.listdir(root):
+        if old != key and not old.startswith('.'):
+            shutil.rmtree(os.path.join(root, old), ignore_errors = True)
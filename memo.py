@@ -0,0 +1,129 @@
+"""Process-wide LRU cache for loader results and chart specs.
+
+Under `panel serve` every session runs in the same process, so caching here
+lets a state viewed by one user be served to the next without recomputing.
+Keys include the loader's data version, so bumping it invalidates old entries.
+Cached values are shared: callers must not mutate them.
+"""
+import functools
+import json
+import sys
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+import metrics
+
+
+def sizeof(value):
+    """Rough size of a cached value in bytes."""
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(value.memory_usage(deep = True).sum())
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    if isinstance(value, dict):
+        return len(json.dumps(value, default = str))
+    return sys.getsizeof(value)
+
+
+class LRUCache():
+    """Least-recently-used cache bounded by entry count and total bytes."""
+
+    def __init__(self, max_items = 512, max_bytes = 256 * 2**20):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, default = None):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        size = sizeof(value)
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= self.entries.pop(key)[1]
+            if size > self.max_bytes:
+                return
+            self.entries[key] = (value, size)
+            self.bytes += size
+            while len(self.entries) > self.max_items or self.bytes > self.max_bytes:
+                self.bytes -= self.entries.popitem(last = False)[1][1]
+                self.evictions += 1
+
+    def get_or_set(self, key, build, current = None):
+        """Returns the cached value for key, calling build() to fill it on a miss.
+
+        If given, current() is called after a build and the value is only
+        stored if it returns True (e.g. the data it was keyed on is unchanged).
+        """
+        sentinel = object()
+        value = self.get(key, sentinel)
+        if value is sentinel:
+            value = build()
+            if current is None or current():
+                self.put(key, value)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        """Returns hit/miss/eviction counters and current size."""
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'evictions': self.evictions,
+                'items': len(self.entries),
+                'bytes': self.bytes,
+            }
+
+
+cache = LRUCache()
+metrics.registry.gauge('memo_cache', cache.stats)
+
+
+def data_version(*loaders):
+    """Key fragment identifying the data behind the given loaders."""
+    return tuple((type(l).__name__, l.path, l.version) for l in loaders)
+
+
+def memoize(method):
+    """Caches a loader method's result in the shared cache, keyed on the
+    method, the loader's source and data version, and the call arguments.
+
+    Lookups are timed as loader_lookup_seconds (hits included) and the rows of
+    computed results recorded as loader_rows (see metrics)."""
+    name = method.__qualname__
+
+    def build(self, args):
+        value = method(self, *args)
+        if isinstance(value, (pd.DataFrame, pd.Series)):
+            metrics.observe('loader_rows', len(value), method = name)
+        return value
+
+    @functools.wraps(method)
+    def wrapper(self, *args):
+        version = data_version(self)
+        key = (name, version) + args
+        with metrics.span('loader_lookup_seconds', method = name):
+            # a result built while an update swapped in new data is not stored
+            # under the old version
+            return cache.get_or_set(key, lambda: build(self, args), lambda: data_version(self) == version)
+    return wrapper
@@ -0,0 +1,178 @@
+"""Opt-in timing and size metrics for the loaders, spec building and callbacks.
+
+Disabled unless the DASH_METRICS environment variable is set (to anything but
+'' or '0') or enable() is called. While disabled, span() and observe() return
+immediately, so the hooks can stay in the hot paths.
+
+Measurements go into histograms keyed on a metric name and labels, e.g.
+`pane_build_seconds{pane="state_pane"}`. dump_prometheus() renders them (plus
+registered gauges such as the shared cache's stats) in the Prometheus text
+format and dump_json() as a dict; MetricsHandler serves either over HTTP:
+
+    pn.serve(dash, extra_patterns = metrics.ROUTES)   # GET /metrics[?format=json]
+"""
+import bisect
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+
+try:
+    import tornado.web
+except ImportError:
+    tornado = None
+
+enabled = os.environ.get('DASH_METRICS', '') not in ('', '0')
+
+# histogram bucket upper bounds: latencies for *_seconds metrics, else counts/bytes
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (10, 100, 1000, 10**4, 10**5, 10**6, 10**7, 10**8)
+
+
+def enable(on = True):
+    global enabled
+    enabled = on
+
+
+class Histogram():
+    """Cumulative-bucket histogram with a running count and sum."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        """(upper bound, observations <= bound) pairs, ending with +Inf."""
+        total, res = 0, []
+        for bound, n in zip(list(self.buckets) + [float('inf')], self.counts):
+            total += n
+            res.append((bound, total))
+        return res
+
+
+class Registry():
+    """Thread-safe set of histograms plus callables reporting gauges."""
+
+    def __init__(self):
+        self.histograms = {}
+        self.gauges = {}
+        self.lock = threading.Lock()
+
+    def observe(self, name, value, labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            h = self.histograms.get(key)
+            if h is None:
+                h = self.histograms[key] = Histogram(
+                    SECONDS_BUCKETS if name.endswith('_seconds') else SIZE_BUCKETS)
+            h.observe(value)
+
+    def gauge(self, prefix, collect):
+        """Registers collect() -> {name: number}, reported as <prefix>_<name> gauges."""
+        self.gauges[prefix] = collect
+
+    def clear(self):
+        with self.lock:
+            self.histograms.clear()
+
+    def snapshot(self):
+        """All metrics as a JSON-serializable dict."""
+        with self.lock:
+            histograms = [{
+                'name': name,
+                'labels': dict(labels),
+                'count': h.count,
+                'sum': h.sum,
+                'buckets': [[str(b), n] for b, n in h.cumulative()],
+            } for (name, labels), h in sorted(self.histograms.items())]
+        gauges = {f'{prefix}_{k}': v for prefix, collect in self.gauges.items()
+                  for k, v in collect().items() if isinstance(v, (int, float))}
+        return {'enabled': enabled, 'histograms': histograms, 'gauges': gauges}
+
+
+registry = Registry()
+
+
+def observe(name, value, **labels):
+    """Records a value (e.g. a row count or spec size) if metrics are enabled."""
+    if enabled:
+        registry.observe(name, value, labels)
+
+
+@contextlib.contextmanager
+def _span(name, labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe(name, time.perf_counter() - start, labels)
+
+
+def span(name, **labels):
+    """Context manager timing its block into histogram `name` (use a *_seconds name)."""
+    return _span(name, labels) if enabled else contextlib.nullcontext()
+
+
+def timed(name, **labels):
+    """Decorator timing every call of a function into histogram `name`."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name, **labels):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{str(v)}"'.replace('\n', ' ') for k, v in labels.items()) + '}'
+
+
+def dump_json():
+    return registry.snapshot()
+
+
+def dump_prometheus():
+    """Metrics in the Prometheus text exposition format."""
+    snap = registry.snapshot()
+    lines, typed = [], set()
+    for h in snap['histograms']:
+        name = 'dash_' + h['name']
+        if name not in typed:
+            lines.append(f'# TYPE {name} histogram')
+            typed.add(name)
+        for bound, n in h['buckets']:
+            le = '+Inf' if bound == 'inf' else bound
+            lines.append(f'{name}_bucket{format_labels(dict(h["labels"], le = le))} {n}')
+        lines.append(f'{name}_sum{format_labels(h["labels"])} {h["sum"]}')
+        lines.append(f'{name}_count{format_labels(h["labels"])} {h["count"]}')
+    for name, value in sorted(snap['gauges'].items()):
+        lines.append(f'# TYPE dash_{name} gauge')
+        lines.append(f'dash_{name} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+if tornado is not None:
+    class MetricsHandler(tornado.web.RequestHandler):
+        """GET: Prometheus text, or JSON with ?format=json."""
+
+        def get(self):
+            if self.get_argument('format', '') == 'json':
+                self.set_header('Content-Type', 'application/json')
+                self.write(json.dumps(dump_json()))
+            else:
+                self.set_header('Content-Type', 'text/plain; version=0.0.4')
+                self.write(dump_prometheus())
+
+    ROUTES = [('/metrics', MetricsHandler)]
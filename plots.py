@@ -1,10 +1,60 @@
+import json
+
 import altair as alt
 import pandas as pd
 
+import memo
+import metrics
+from data_loader import DESTINATIONS, weekly, clip_dates
+from regions import region_store
+
+# Each pane embeds every source frame once, as a top-level named dataset that
+# all of its charts refer to. Charts fold wide frames into long form in
+# Vega-Lite instead of receiving pre-melted copies, and only encoded columns
+# are embedded.
+
+# decimals kept for metric values; float32 noise past this only bloats specs
+DECIMALS = 2
+
+def records(df, columns):
+    """Returns the given columns of df as Vega-Lite inline data values."""
+    df = df[columns]
+    floats = df.select_dtypes('floating').columns
+    df = df.astype({c: 'float64' for c in floats}).round({c: DECIMALS for c in floats})
+    return alt.utils.data.to_values(df)['values']
+
+def with_datasets(chart, **datasets):
+    """Attaches named datasets (as returned by records) to a top-level chart."""
+    chart.datasets = datasets
+    return chart
+
+# Resolution modes. 'daily' embeds every day of every series. 'weekly' keeps
+# the payload bounded as history grows: the overview chart (the one carrying
+# the brush) shows weekly means of the full history, and the detail charts
+# show daily data for `dates` only, by default the last DETAIL_DAYS days.
+DETAIL_DAYS = 120
+
+def overview(df, resolution, keys = ()):
+    """Frame for a pane's overview chart."""
+    return weekly(df, keys) if resolution == 'weekly' else df
+
+def detail(df, resolution, dates):
+    """Frame for a pane's detail charts."""
+    if dates is None and resolution == 'weekly':
+        end = df['date'].max()
+        dates = (end - pd.Timedelta(days = DETAIL_DAYS - 1), end)
+    return df if dates is None else clip_dates(df, *dates)
+
+def date_key(dates):
+    """Normalizes a (start, end) pair for use in cache keys."""
+    return None if dates is None else tuple(pd.Timestamp(d) for d in dates)
+
 def country_pane(apple_us, google_us, cases_us):
     brush = alt.selection_interval(encodings=['x'])
 
-    p1 = alt.Chart(apple_us).mark_line(interpolate='monotone').encode(
+    p1 = alt.Chart(alt.NamedData('apple')).transform_fold(
+        ['driving', 'transit', 'walking'], as_ = ['transportation_type', 'volume']
+    ).mark_line(interpolate='monotone').encode(
         x = alt.X('date:T'),
         y = 'volume:Q',
         color = alt.Color('transportation_type:N', scale=alt.Scale(scheme="tableau20"),
@@ -13,7 +63,7 @@ def country_pane(apple_us, google_us, cases_us):
                                                      'parks', 'residential', 'workplaces',
                                                      'grocery_pharmacy', 'retail_recreation',
                                                      'transit_stations'])),
-        tooltip = ['date', 'transportation_type', 'volume']
+        tooltip = ['date:T', 'transportation_type:N', 'volume:Q']
     ).add_selection(brush).properties(
         title = {'text': 'How are people getting around?',
                 'subtitle': 'Source: Apple mobility data, request volumes indexed to Jan 13',
@@ -24,7 +74,9 @@ def country_pane(apple_us, google_us, cases_us):
     highlight = alt.selection(type='single', on='mouseover',
                                   fields=['destination_type'], nearest=True)
 
-    p2 = alt.Chart(google_us).mark_line(interpolate='monotone').encode(
+    p2 = alt.Chart(alt.NamedData('google')).transform_fold(
+        DESTINATIONS, as_ = ['destination_type', 'volume']
+    ).mark_line(interpolate='monotone').encode(
         x = alt.X('date:T', scale = alt.Scale(domain = brush)),
         y = 'volume:Q',
         color = 'destination_type:N'
@@ -45,12 +97,12 @@ def country_pane(apple_us, google_us, cases_us):
             size=alt.condition(~highlight, alt.value(1), alt.value(3))
         )
     
-    c1 = alt.Chart(cases_us).mark_bar(color = 'lightgrey').encode(
+    c1 = alt.Chart(alt.NamedData('cases')).mark_bar(color = 'lightgrey').encode(
         x = alt.X('date:T', scale = alt.Scale(domain = brush)),
         y = 'cases:Q'
         ).properties(title = 'Cumulative Cases')
 
-    c2 = alt.Chart(cases_us).mark_bar(color = 'lightblue').encode(
+    c2 = alt.Chart(alt.NamedData('cases')).mark_bar(color = 'lightblue').encode(
             x = alt.X('date:T', scale = alt.Scale(domain = brush)),
             y = alt.Y('new_cases:Q', title = 'cases')
         ).properties(title = 'Daily New Cases')
@@ -60,12 +112,15 @@ def country_pane(apple_us, google_us, cases_us):
         (c1 | c2)
     )
     
-    return plot
+    return with_datasets(plot,
+        apple = records(apple_us, ['date', 'driving', 'transit', 'walking']),
+        google = records(google_us, ['date'] + DESTINATIONS),
+        cases = records(cases_us, ['date', 'cases', 'new_cases']))
 
 def state_pane(apple, google, cases):
     brush = alt.selection_interval(encodings=['x'])
 
-    p1 = alt.Chart(apple).mark_line(interpolate='monotone').encode(
+    p1 = alt.Chart(alt.NamedData('apple')).mark_line(interpolate='monotone').encode(
         x = alt.X('date:T'),
         y = alt.Y('7_day:Q', title = '7-day average'),
         color = alt.Color('transportation_type:N', scale=alt.Scale(scheme="tableau20"))
@@ -79,7 +134,9 @@ def state_pane(apple, google, cases):
     highlight = alt.selection(type='single', on='mouseover',
                                   fields=['destination_type'], nearest=True)
 
-    p2 = alt.Chart(google).mark_line(interpolate='monotone').encode(
+    p2 = alt.Chart(alt.NamedData('google')).transform_fold(
+        DESTINATIONS, as_ = ['destination_type', 'volume']
+    ).mark_line(interpolate='monotone').encode(
         x = alt.X('date:T', scale = alt.Scale(domain = brush)),
         y = 'volume:Q',
         color = alt.Color('destination_type:N',
@@ -104,16 +161,17 @@ def state_pane(apple, google, cases):
             size=alt.condition(~highlight, alt.value(1), alt.value(3))
         )
     
-    c1 = alt.Chart(cases).mark_bar(color = 'lightgrey').encode(
+    c1 = alt.Chart(alt.NamedData('cases')).mark_bar(color = 'lightgrey').encode(
         x = alt.X('date:T', scale = alt.Scale(domain = brush)),
         y = 'cases:Q'
         ).properties(title = 'Cumulative Cases')
     
-    m = cases['new_cases'].max()
-
-    c2 = alt.Chart(cases).mark_bar(color = 'lightblue').encode(
+    # y runs from 0 (negative JHU corrections are clamped to it) to the data's
+    # maximum, derived by Vega-Lite rather than embedded, so the chart template
+    # is the same for every state and county
+    c2 = alt.Chart(alt.NamedData('cases')).mark_bar(color = 'lightblue').encode(
             x = alt.X('date:T', scale = alt.Scale(domain = brush)),
-            y = alt.Y('new_cases:Q', title = 'cases', scale = alt.Scale(domain = (0, m)))
+            y = alt.Y('new_cases:Q', title = 'cases', scale = alt.Scale(domainMin = 0, clamp = True))
         ).properties(title = 'Daily New Cases')
 
     plot = alt.vconcat(
@@ -121,25 +179,39 @@ def state_pane(apple, google, cases):
         (c1 | c2)
     )
     
-    return plot
-
-def state_comp(a, b, apple, google, cases):
-    s1, s2 = apple.get_state(a), apple.get_state(b)
-
-    c1 = cases.get_state(a)
-    c2 = cases.get_state(b)
-
-    s = pd.concat([s1, s2])
-    dat = pd.concat([c1, c2])
-    m = dat['new_cases'].max() 
-    mc = dat['cases'].max()
+    return with_datasets(plot,
+        apple = records(apple, ['date', '7_day']),
+        google = records(google, ['date'] + DESTINATIONS),
+        cases = records(cases, ['date', 'cases', 'new_cases']))
+
+# columns of the joined regions data (see regions) shown in state_comp's detail charts
+COMP_METRICS = ['cases', 'new_cases', 'workplaces', 'grocery_pharmacy', 'parks']
+
+def comp_frames(states, apple, google, cases, resolution = 'daily', dates = None):
+    """Frames behind state_comp: (driving overview, detail rows) of the states,
+    fetched for all of them at once from the joined regions data."""
+    rows = region_store(apple, google, cases).get_states(states, ['driving_7_day'] + COMP_METRICS)
+    driving = overview(rows[['state', 'date', 'driving_7_day']].dropna(), resolution, ['state'])
+    rows = detail(rows[['state', 'date'] + COMP_METRICS].dropna(how = 'all', subset = COMP_METRICS),
+                  resolution, dates)
+    return driving, rows
+
+def state_comp(states, apple, google, cases, resolution = 'daily', dates = None):
+    """Compares any number of states (by name)."""
+    return comp_pane(*comp_frames(states, apple, google, cases, resolution, dates))
+
+def comp_pane(driving, rows):
+    # no states picked (or none with data): leave the scale to Vega-Lite
+    # rather than embedding a NaN bound
+    m = rows['new_cases'].max()
+    new_scale = alt.Undefined if pd.isna(m) else alt.Scale(domain = (0, m))
     
     brush = alt.selection_interval(encodings=['x'])
 
-    driv = alt.Chart(s).mark_line().encode(
+    driv = alt.Chart(alt.NamedData('apple')).mark_line().encode(
         x = 'date:T',
-        y = alt.Y('7_day', title = 'request volume'),
-        color = alt.Color('state', legend = alt.Legend(title = "State"), scale = alt.Scale(scheme='dark2'))
+        y = alt.Y('driving_7_day:Q', title = 'request volume'),
+        color = alt.Color('state:N', legend = alt.Legend(title = "State"), scale = alt.Scale(scheme='dark2'))
     ).add_selection(brush).properties(
         width = 300,
         title = {'text': 'Driving directions requests',
@@ -148,57 +220,108 @@ def state_comp(a, b, apple, google, cases):
     )
 
 
-    new = alt.Chart(dat).mark_bar(interpolate = 'monotone', opacity = 0.5).encode(
+    new = alt.Chart(alt.NamedData('regions')).mark_bar(interpolate = 'monotone', opacity = 0.5).encode(
         x = alt.X('date:T', scale = alt.Scale(domain = brush)),
-        y = alt.Y('new_cases', stack = None, title = 'cases', scale = alt.Scale(domain = (0, m))),
-        color = 'Province_State',
-        tooltip = ['Province_State', 'date', 'new_cases']
+        y = alt.Y('new_cases:Q', stack = None, title = 'cases', scale = new_scale),
+        color = 'state:N',
+        tooltip = ['state:N', 'date:T', 'new_cases:Q']
     ).properties(width = 300, title = {'text':'New Cases',
                           'subtitle': 'Source: JHU'})
 
-    cum = alt.Chart(dat).mark_area(interpolate = 'monotone', opacity = 0.5).encode(
+    cum = alt.Chart(alt.NamedData('regions')).mark_area(interpolate = 'monotone', opacity = 0.5).encode(
         x = alt.X('date:T', scale = alt.Scale(domain = brush)),
-        y = alt.Y('cases', stack = None),
-        color = 'Province_State'
+        y = alt.Y('cases:Q', stack = None),
+        color = 'state:N'
     ).properties(width = 300, title = {'text':'Cumulative Cases',
                           'subtitle': 'Source: JHU'})
 
     
-    # google mobility data comparisons
-    g1 = google.get_state(a)
-    g2 = google.get_state(b)
-    goog = pd.concat([g1, g2])
-
-    work = pd.DataFrame(goog[goog.destination_type == "workplaces"])
-    grocery = pd.DataFrame(goog[goog.destination_type == "grocery_pharmacy"])
-    park = pd.DataFrame(goog[goog.destination_type == "parks"])
-
-    
-    wk = alt.Chart(work).mark_line(interpolate = 'monotone', opacity = 0.7).encode(
+    # google mobility data comparisons: one column per chart
+    wk = alt.Chart(alt.NamedData('regions')).mark_line(interpolate = 'monotone', opacity = 0.7).encode(
         x = alt.X('date:T', scale = alt.Scale(domain = brush)),
-        y = 'volume:Q',
-        color = 'sub_region_1:N'
+        y = alt.Y('workplaces:Q', title = 'volume'),
+        color = 'state:N'
     ).properties(title = {'text':'Workplace traffic',
                           'subtitle': 'Source: Google mobility data'}, width = 300)
 
-    gr = alt.Chart(grocery).mark_line(interpolate = 'monotone', opacity = 0.7).encode(
+    gr = alt.Chart(alt.NamedData('regions')).mark_line(interpolate = 'monotone', opacity = 0.7).encode(
         x = alt.X('date:T', scale = alt.Scale(domain = brush)),
-        y = 'volume:Q',
-        color = 'sub_region_1:N'
+        y = alt.Y('grocery_pharmacy:Q', title = 'volume'),
+        color = 'state:N'
     ).properties(title = {'text':'Grocery/pharmacy traffic',
                           'subtitle': 'Source: Google mobility data'}, width = 300)
 
-    pk = alt.Chart(park).mark_line(interpolate = 'monotone', opacity = 0.7).encode(
+    pk = alt.Chart(alt.NamedData('regions')).mark_line(interpolate = 'monotone', opacity = 0.7).encode(
         x = alt.X('date:T', scale = alt.Scale(domain = brush)),
-        y = 'volume:Q',
-        color = 'sub_region_1:N'
+        y = alt.Y('parks:Q', title = 'volume'),
+        color = 'state:N'
     ).properties(title = {'text':'Parks traffic',
                           'subtitle': 'Source: Google mobility data'}, width = 300)
 
 
     res = alt.vconcat((driv | new | cum), (wk | gr | pk))
     
-    return res
+    return with_datasets(res,
+        apple = records(driving, ['state', 'date', 'driving_7_day']),
+        regions = records(rows, ['state', 'date'] + COMP_METRICS))
+
+
+# Cached Vega-Lite specs. Building and validating the Altair chart dominates
+# callback time, so the finished spec dict is kept in the shared LRU cache,
+# keyed on the selection, resolution, detail dates and the loaders' data versions.
+
+def render_spec(pane, lookup):
+    """Returns pane(*lookup()).to_dict().
+
+    The lookup, chart build and serialization are timed separately as
+    pane_{lookup,build,serialize}_seconds, and the spec's embedded rows and
+    JSON bytes recorded (see metrics).
+    """
+    name = pane.__name__
+    with metrics.span('pane_lookup_seconds', pane = name):
+        frames = lookup()
+    with metrics.span('pane_build_seconds', pane = name):
+        chart = pane(*frames)
+    with metrics.span('pane_serialize_seconds', pane = name):
+        spec = chart.to_dict()
+    if metrics.enabled:
+        metrics.observe('pane_rows', sum(len(v) for v in spec.get('datasets', {}).values()), pane = name)
+        metrics.observe('pane_spec_bytes', len(json.dumps(spec)), pane = name)
+    return spec
+
+def country_spec(apple, google, cases, resolution = 'daily', dates = None):
+    """Returns the country_pane spec."""
+    dates = date_key(dates)
+    key = ('country_pane', resolution, dates, memo.data_version(apple, google, cases))
+    return memo.cache.get_or_set(key, lambda: render_spec(country_pane, lambda: (
+        overview(apple.get_country(), resolution),
+        detail(google.get_country(), resolution, dates),
+        detail(cases.get_country(), resolution, dates))))
+
+def state_spec(state, apple, google, cases, resolution = 'daily', dates = None):
+    """Returns the state_pane spec for a state."""
+    dates = date_key(dates)
+    key = ('state_pane', state, resolution, dates, memo.data_version(apple, google, cases))
+    return memo.cache.get_or_set(key, lambda: render_spec(state_pane, lambda: (
+        overview(apple.get_state(state), resolution),
+        detail(google.get_state_wide(state), resolution, dates),
+        detail(cases.get_state(state), resolution, dates))))
+
+def county_spec(state, county, apple, google, cases, resolution = 'daily', dates = None):
+    """Returns the state_pane spec for a state, county pair."""
+    dates = date_key(dates)
+    key = ('county_pane', state, county, resolution, dates, memo.data_version(apple, google, cases))
+    return memo.cache.get_or_set(key, lambda: render_spec(state_pane, lambda: (
+        overview(apple.get_county(state, county), resolution),
+        detail(google.get_county_wide(state, county), resolution, dates),
+        detail(cases.get_county(state, county), resolution, dates))))
+
+def state_comp_spec(states, apple, google, cases, resolution = 'daily', dates = None):
+    """Returns the state_comp spec for a list of states."""
+    states, dates = tuple(states), date_key(dates)
+    key = ('state_comp', states, resolution, dates, memo.data_version(apple, google, cases))
+    return memo.cache.get_or_set(key, lambda: render_spec(comp_pane, lambda: comp_frames(
+        states, apple, google, cases, resolution, dates)))
 
 
 
@@ -0,0 +1,230 @@
+"""Apple, Google and JHU metrics joined on (FIPS code, date).
+
+Cross-source views used to look each region up in every loader separately and
+concatenate the pieces. RegionStore joins the three sources once per geography
+level into one frame sorted by FIPS code and date, with a row for every region
+on every date from the earliest to the latest date in any source (NaN where a
+source has no value). Each region is then a fixed-size block of rows, so
+fetching any set of regions and metrics is a single vectorized gather whose
+cost grows only with the number of regions asked for (see RegionStore.get).
+
+Regions are keyed by the FIPS codes in the JHU data: 2 digits for states, 5 for
+counties. Apple and Google name their regions instead and are mapped onto the
+codes by name; county names are tried as given and then without their last
+word, since JHU's Admin2 drops the 'County'/'Parish'/... suffix (but keeps it
+in names like 'Baltimore City'). Regions without a JHU code are left out.
+
+Joined frames go through the frame cache, keyed on all three sources, and are
+rebuilt whenever a loader's data changes.
+"""
+import threading
+
+import numpy as np
+import pandas as pd
+
+import memo
+from data_loader import DESTINATIONS, compact, frames, load_frame
+
+# joined metric columns per level (Google has no 7-day averages for counties)
+STATE_METRICS = (['driving', 'driving_7_day'] + DESTINATIONS + [c + '_7_day' for c in DESTINATIONS] +
+                 ['cases', 'new_cases', 'new_cases_7_day'])
+COUNTY_METRICS = ['driving', 'driving_7_day'] + DESTINATIONS + ['cases', 'new_cases', 'new_cases_7_day']
+
+# region name columns per level
+LEVEL_KEYS = {'states': ['state'], 'counties': ['state', 'county']}
+
+# JHU codes from 80000 up are 'Out of <state>' and 'Unassigned' pseudo-counties
+LAST_COUNTY_CODE = 79999
+
+
+def county_codes(cases):
+    """(Province_State, Admin2) -> county FIPS code, one entry per JHU county."""
+    data, index = frames(cases, 'data', 'county_index')
+    first = [rows.start for rows in index.values()]
+    codes = data['FIPS'].to_numpy()[first]
+    return {k: int(c) for k, c in zip(index, codes) if 1000 <= c <= LAST_COUNTY_CODE}
+
+
+def state_codes(counties):
+    """State name -> state FIPS code, from the county codes."""
+    return {state: code // 1000 for (state, _), code in counties.items()}
+
+
+def county_code(codes, state, county):
+    """FIPS code of a county named as in Apple or Google data, or 0 if unknown."""
+    for name in (county, county.rsplit(' ', 1)[0]):
+        if (state, name) in codes:
+            return codes[state, name]
+    return 0
+
+
+def row_codes(df, index, code_of):
+    """FIPS code of every row of a region-sorted frame (0 where unknown), one lookup per region."""
+    codes = np.zeros(len(df), dtype = 'int32')
+    for key, rows in index.items():
+        codes[rows] = code_of(key)
+    return codes
+
+
+def join_columns(codes, dates, parts, metrics):
+    """Scatters each part's metric columns onto a dense codes x dates grid.
+
+    parts are frames with 'fips' and 'date' columns; rows with unknown codes
+    (or dates) are dropped.
+    """
+    n = len(dates)
+    res = {'fips': np.repeat(codes, n).astype('int32'), 'date': np.tile(dates, len(codes))}
+    for part in parts:
+        fips = part['fips'].to_numpy()
+        region = np.searchsorted(codes, fips).clip(0, len(codes) - 1)
+        day = np.searchsorted(dates, part['date'].to_numpy()).clip(0, n - 1)
+        known = (codes[region] == fips) & (dates[day] == part['date'].to_numpy())
+        rows = region[known] * n + day[known]
+        for col in [c for c in metrics if c in part]:
+            values = np.full(len(codes) * n, np.nan, dtype = 'float32')
+            values[rows] = part[col].to_numpy()[known]
+            res[col] = values
+    return pd.DataFrame({k: res.get(k, np.full(len(codes) * n, np.nan, dtype = 'float32'))
+                         for k in ['fips', 'date'] + metrics})
+
+
+class RegionStore():
+    """Apple, Google and JHU metrics per region and date, joined once per level.
+
+    Levels ('states', 'counties') are built, or loaded from the frame cache, on
+    first use. Use region_store() to share one store between callers.
+    """
+    cache_prefix = 'regions/'
+
+    def __init__(self, apple, google, cases):
+        self.loaders = (apple, google, cases)
+        self.levels = {}
+        self.lock = threading.Lock()
+
+    def level(self, name):
+        """(joined frame, regions frame, dates, {code: position}) of a level."""
+        version = memo.data_version(*self.loaders)
+        with self.lock:
+            if name not in self.levels or self.levels[name][0] != version:
+                self.levels[name] = (version, self.load_level(name))
+            return self.levels[name][1]
+
+    def load(self, name, build):
+        # cached only if every loader uses the same frame cache
+        cache_dirs = {l.cache_dir for l in self.loaders}
+        cache_dir = cache_dirs.pop() if len(cache_dirs) == 1 else None
+        return load_frame(self.cache_prefix + name, [l.path for l in self.loaders], build, cache_dir)
+
+    def load_level(self, name):
+        built = {}
+
+        def build(frame):
+            # one join yields both frames of the level
+            if not built:
+                built['joined'], built['regions'] = getattr(self, 'join_' + name)()
+            return built[frame]
+
+        joined = self.load(name, lambda: build('joined'))
+        regions = self.load(name + '_regions', lambda: build('regions'))
+        n = len(joined) // len(regions) if len(regions) else 0
+        dates = joined['date'].to_numpy()[:n]
+        positions = {c: i for i, c in enumerate(regions['fips'].tolist())}
+        return joined, regions, dates, positions
+
+    def join(self, level, parts, names, metrics):
+        """Joined frame and regions frame (codes and names) of a level from its
+        sources' parts; names maps each code to its name key."""
+        codes = np.array(sorted(names), dtype = 'int32')
+        dates = pd.date_range(min(p['date'].min() for p in parts),
+                              max(p['date'].max() for p in parts)).to_numpy()
+        joined = join_columns(codes, dates, parts, metrics)
+        regions = pd.DataFrame([(c,) + names[c] for c in codes.tolist()],
+                               columns = ['fips'] + LEVEL_KEYS[level])
+        return compact(joined), compact(regions)
+
+    def join_states(self):
+        apple, google, cases = self.loaders
+        codes = state_codes(county_codes(cases))
+        code_of = lambda state: codes.get(state, 0)
+
+        parts, names = [], {}
+        for loader, rename in ((cases, {}), (google, {}), (apple, {'7_day': 'driving_7_day'})):
+            df, index = frames(loader, 'states', 'state_index')
+            parts.append(df.rename(columns = rename).assign(fips = row_codes(df, index, code_of)))
+            # names from later sources win: Apple's, then Google's, then JHU's
+            names.update({code_of(k): (k,) for k in index if code_of(k)})
+        return self.join('states', parts, names, STATE_METRICS)
+
+    def join_counties(self):
+        apple, google, cases = self.loaders
+        codes = county_codes(cases)
+        code_of = lambda key: county_code(codes, *key)
+
+        data = cases.data.assign(fips = cases.data['FIPS'])
+        parts = [data[(data['fips'] >= 1000) & (data['fips'] <= LAST_COUNTY_CODE)]]
+        names = {c: k for k, c in codes.items()}
+        for loader, rename in ((google, {}), (apple, {'7_day': 'driving_7_day'})):
+            df, index = frames(loader, 'counties', 'county_index')
+            # Google's counties are indexed by date
+            df = df.reset_index() if loader is google else df
+            parts.append(df.rename(columns = rename).assign(fips = row_codes(df, index, code_of)))
+            names.update({code_of(k): k for k in index if code_of(k)})
+        return self.join('counties', parts, names, COUNTY_METRICS)
+
+    def codes(self, level, names):
+        """FIPS codes of regions by name ('Maryland', or ('Virginia', 'Fairfax County')
+        for counties), skipping unknown names."""
+        regions = self.level(level)[1]
+        keys = regions[LEVEL_KEYS[level]].itertuples(index = False, name = None)
+        lookup = {k[0] if level == 'states' else k: c for k, c in zip(keys, regions['fips'].tolist())}
+        return [lookup[n] for n in names if n in lookup]
+
+    def get(self, level, codes, metrics = None, dates = None):
+        """Rows of the regions with the given FIPS codes, in that order.
+
+        Returns the regions' name columns, 'fips', 'date' and the given metric
+        columns (all of the level's by default), optionally only for dates
+        (start, end), inclusive. Unknown codes are skipped.
+        """
+        joined, regions, days, positions = self.level(level)
+        metrics = (STATE_METRICS if level == 'states' else COUNTY_METRICS) if metrics is None else list(metrics)
+        first, last = 0, len(days)
+        if dates is not None:
+            first = np.searchsorted(days, np.datetime64(pd.Timestamp(dates[0])))
+            last = np.searchsorted(days, np.datetime64(pd.Timestamp(dates[1])), side = 'right')
+
+        found = np.array([positions[c] for c in codes if c in positions], dtype = 'int64')
+        rows = (found[:, None] * len(days) + np.arange(first, last)).ravel()
+        per_region = np.repeat(found, last - first)
+        res = {k: regions[k].iloc[per_region].reset_index(drop = True) for k in ['fips'] + LEVEL_KEYS[level]}
+        res['date'] = np.tile(days[first:last], len(found))
+        for col in metrics:
+            res[col] = joined[col].to_numpy()[rows]
+        return pd.DataFrame(res)
+
+    def get_states(self, states, metrics = None, dates = None):
+        """get() for states by name."""
+        return self.get('states', self.codes('states', states), metrics, dates)
+
+    def get_counties(self, counties, metrics = None, dates = None):
+        """get() for (state, county) name pairs."""
+        return self.get('counties', self.codes('counties', counties), metrics, dates)
+
+
+# shared stores by the data they join, so every session's loaders over the same
+# sources use one store
+stores = {}
+stores_lock = threading.Lock()
+
+
+def region_store(apple, google, cases):
+    """The RegionStore shared by all callers using loaders with this data."""
+    key = memo.data_version(apple, google, cases)
+    with stores_lock:
+        store = stores.get(key)
+        if store is None:
+            # drop stores whose loaders' data has since moved on (e.g. refreshed)
+            for old in [k for k, s in stores.items() if memo.data_version(*s.loaders) != k]:
+                del stores[old]
+            store = stores[key] = RegionStore(apple, google, cases)
+        return store
@@ -0,0 +1,108 @@
+"""Case-insensitive prefix and fuzzy search over region names.
+
+NameIndex is built once from a list of unique names (e.g. the 'State, County'
+keys of a loader's region index) and answers queries by bisecting a sorted list
+of lowercased word suffixes, falling back to trigram similarity for typos, so a
+query costs well under a millisecond for every US county.
+
+Results are ranked: exact matches, then names starting with the query, then
+names with a later word starting with it (e.g. 'fairf' finds 'Virginia,
+Fairfax County'), then fuzzy matches by similarity; ties go to the shorter
+name, then alphabetically.
+"""
+import bisect
+import heapq
+import re
+from collections import Counter
+
+# minimum share of the query's trigrams a fuzzy match must contain
+MIN_SIMILARITY = 0.5
+
+# trigrams found in more names than this (e.g. the 'cou', 'oun', ... of
+# 'County' among US counties) cannot tell names apart and are left out of fuzzy
+# search, which also bounds its cost
+MAX_POSTINGS = 500
+
+
+def normalize(text):
+    """Lowercases and collapses punctuation and whitespace to single spaces."""
+    return ' '.join(re.sub(r'[^\w]+', ' ', text.lower()).split())
+
+
+def trigrams(text):
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class NameIndex():
+    """Search index over a fixed list of names.
+
+    Names are kept in ranking tie-break order (shorter first, then
+    alphabetically), so a name's position is its tie-break key.
+    """
+
+    def __init__(self, names):
+        self.names = sorted(set(names), key = lambda n: (len(n), n))
+        self.normalized = [normalize(n) for n in self.names]
+
+        # whole names and the suffixes starting at their later words, sorted
+        # for prefix bisection
+        starts, words = [], []
+        for i, text in enumerate(self.normalized):
+            starts.append((text, i))
+            words += [(text[m.start():], i) for m in re.finditer(r'\b\w', text) if m.start() > 0]
+        starts.sort()
+        words.sort()
+        self.starts, self.start_positions = [s[0] for s in starts], [s[1] for s in starts]
+        self.words, self.word_positions = [w[0] for w in words], [w[1] for w in words]
+
+        self.grams = {}
+        for i, text in enumerate(self.normalized):
+            for gram in trigrams(text):
+                self.grams.setdefault(gram, []).append(i)
+
+    def __len__(self):
+        return len(self.names)
+
+    @staticmethod
+    def matching(keys, positions, query):
+        """Positions of the entries of sorted `keys` starting with query."""
+        start = bisect.bisect_left(keys, query)
+        end = bisect.bisect_left(keys, query + '\uffff', start)
+        return positions[start:end]
+
+    def prefix(self, query, limit):
+        """(rank, position) of the best `limit` names with a word starting with
+        a normalized query; rank 0 exact, 1 prefix, 2 later word prefix."""
+        # exact matches sort first among the names starting with the query
+        res = [(0 if self.normalized[i] == query else 1, i)
+               for i in self.matching(self.starts, self.start_positions, query)]
+        res = heapq.nsmallest(limit, res)
+        if len(res) < limit:
+            # later words are only searched for the remaining places
+            found = {i for _, i in res}
+            later = set(self.matching(self.words, self.word_positions, query)) - found
+            res += [(2, i) for i in heapq.nsmallest(limit - len(res), later)]
+        return res
+
+    def fuzzy(self, query):
+        """{name position: similarity} for names sharing enough trigrams with a
+        normalized query, ignoring trigrams too common to tell names apart."""
+        grams = [g for g in trigrams(query) if len(self.grams.get(g, ())) <= MAX_POSTINGS]
+        counts = Counter()
+        for gram in grams:
+            counts.update(self.grams.get(gram, ()))
+        need = MIN_SIMILARITY * len(grams)
+        return {i: n / len(grams) for i, n in counts.items() if n >= need}
+
+    def search(self, query, limit = 10):
+        """Up to `limit` names matching query, best first."""
+        query = normalize(query)
+        if not query:
+            return []
+        ranked = [(rank, 0, i) for rank, i in self.prefix(query, limit)]
+        # typos are only looked for if the query does not name a region exactly
+        if len(ranked) < limit and not (ranked and ranked[0][0] == 0):
+            found = {i for _, _, i in ranked}
+            ranked += [(3, -score, i) for i, score in self.fuzzy(query).items() if i not in found]
+        return [self.names[r[2]] for r in heapq.nsmallest(limit, ranked)]
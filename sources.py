@@ -0,0 +1,163 @@
+"""Local, versioned snapshots of remote data files.
+
+Loaders read from the newest local snapshot, so startup never waits on the
+network and works offline. refresh() downloads a new snapshot only when the
+remote file has changed, using ETag/Last-Modified conditional requests.
+
+Refresh the JHU snapshot from the command line with: python sources.py
+"""
+import datetime
+import hashlib
+import http.server
+import json
+import os
+import shutil
+import tempfile
+import threading
+import urllib.error
+import urllib.request
+
+JHU_URL = 'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_confirmed_US.csv'
+SNAPSHOT_DIR = 'data/snapshots'
+
+
+class SnapshotSource():
+    """Versioned local copies of the file at `url`.
+
+    Snapshots are stored in `directory` as <name>-<UTC timestamp>.csv, newest
+    last in sort order; manifest.json holds the validators of the newest one.
+    Only the `keep` most recent snapshots are retained.
+    """
+
+    def __init__(self, url, name, directory = SNAPSHOT_DIR, keep = 3):
+        self.url = url
+        self.name = name
+        self.directory = os.path.join(directory, name)
+        self.keep = keep
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.directory, 'manifest.json')
+
+    def snapshots(self):
+        """Returns paths of all stored snapshots, oldest first."""
+        if not os.path.isdir(self.directory):
+            return []
+        names = sorted(f for f in os.listdir(self.directory)
+                       if f.startswith(self.name + '-') and f.endswith('.csv'))
+        return [os.path.join(self.directory, f) for f in names]
+
+    def latest(self):
+        """Returns the newest snapshot's path, or None if there are none."""
+        snapshots = self.snapshots()
+        return snapshots[-1] if snapshots else None
+
+    @property
+    def path(self):
+        """Newest snapshot, fetched once if none has been stored yet."""
+        return self.latest() or self.refresh()
+
+    def manifest(self):
+        if not os.path.isfile(self.manifest_path):
+            return {}
+        with open(self.manifest_path) as f:
+            return json.load(f)
+
+    def refresh(self, timeout = 30):
+        """Downloads the file if it changed since the newest snapshot.
+
+        Returns the path of the newest snapshot afterwards.
+        """
+        latest = self.latest()
+        headers = {}
+        if latest is not None:
+            manifest = self.manifest()
+            if manifest.get('etag'):
+                headers['If-None-Match'] = manifest['etag']
+            if manifest.get('last_modified'):
+                headers['If-Modified-Since'] = manifest['last_modified']
+
+        request = urllib.request.Request(self.url, headers = headers)
+        try:
+            response = urllib.request.urlopen(request, timeout = timeout)
+        except urllib.error.HTTPError as e:
+            if e.code == 304 and latest is not None:
+                return latest
+            raise
+
+        os.makedirs(self.directory, exist_ok = True)
+        stamp = datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%dT%H%M%S%f')
+        path = os.path.join(self.directory, f'{self.name}-{stamp}.csv')
+
+        # download to a scratch file and rename so readers never see a partial
+        # snapshot; a failed download's scratch file is removed (pruning only
+        # looks at snapshots)
+        part = tempfile.NamedTemporaryFile(dir = self.directory, suffix = '.part', delete = False)
+        try:
+            with response, part:
+                shutil.copyfileobj(response, part)
+            os.replace(part.name, path)
+        except BaseException:
+            os.remove(part.name)
+            raise
+
+        with open(self.manifest_path, 'w') as f:
+            json.dump({
+                'url': self.url,
+                'path': os.path.basename(path),
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+            }, f)
+
+        for old in self.snapshots()[:-self.keep]:
+            os.remove(old)
+        return path
+
+
+jhu = SnapshotSource(JHU_URL, 'jhu_confirmed_US')
+
+
+class ValidatingHandler(http.server.SimpleHTTPRequestHandler):
+    """Static file handler that also sends ETags and answers If-None-Match with 304.
+
+    (SimpleHTTPRequestHandler already handles Last-Modified/If-Modified-Since.)
+    """
+
+    def etag(self, path):
+        st = os.stat(path)
+        return '"' + hashlib.sha1(f'{st.st_mtime_ns}-{st.st_size}'.encode()).hexdigest()[:16] + '"'
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if os.path.isfile(path) and self.headers.get('If-None-Match') == self.etag(path):
+            self.send_response(304)
+            self.end_headers()
+            return None
+        return super().send_head()
+
+    def end_headers(self):
+        path = self.translate_path(self.path)
+        if os.path.isfile(path):
+            self.send_header('ETag', self.etag(path))
+        super().end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def serve_directory(directory, port = 0):
+    """Serves `directory` over HTTP on localhost from a background thread.
+
+    A stand-in for the remote host when testing refreshes offline. Returns the
+    server (call .shutdown() when done) and its base URL.
+    """
+    handler = lambda *args, **kwargs: ValidatingHandler(*args, directory = directory, **kwargs)
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', port), handler)
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+if __name__ == '__main__':
+    before = jhu.latest()
+    after = jhu.refresh()
+    print(f'{jhu.name}: ' + ('unchanged' if after == before else f'new snapshot {after}'))
@@ -0,0 +1,177 @@
+"""Pre-rendered Vega-Lite specs for the country, every state and every county.
+
+The data only changes once a day, so `python spec_store.py` renders every
+pane ahead of time across a process pool and the dashboard serves the stored
+spec by key instead of building Altair charts per callback.
+
+Each spec is split into its chart template and its named datasets. Templates
+are stored once under templates/ and shared by all panes of the same kind;
+each pane's datasets are stored column-wise and gzipped under <kind>/.
+manifest.json records a key of the source files the store was built from (as
+in frame_cache) and the resolution (see plots) it was rendered at, so a store
+that no longer matches the loaders' data is ignored.
+
+Build with: python spec_store.py [directory] [daily|weekly]
+"""
+import gzip
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import frame_cache
+import memo
+from data_loader import AppleDataLoader, GoogleDataLoader, CaseDataLoader
+from plots import country_spec, state_spec, county_spec
+
+SPEC_DIR = 'data/specs'
+
+# loaders and resolution of the current build worker, set by init_worker
+loaders = None
+resolution = 'daily'
+
+
+def split_spec(spec):
+    """Splits a spec dict into (template JSON text, columnar datasets)."""
+    spec = dict(spec)
+    datasets = spec.pop('datasets', {})
+    text = json.dumps(spec, sort_keys = True, separators = (',', ':'))
+    columns = {}
+    for name, records in datasets.items():
+        keys = list(records[0]) if records else []
+        columns[name] = {k: [r.get(k) for r in records] for k in keys}
+    return text, columns
+
+
+def join_spec(template, columns):
+    """Inverse of split_spec: returns the spec dict with datasets restored."""
+    spec = json.loads(template)
+    spec['datasets'] = {
+        name: [dict(zip(cols, row)) for row in zip(*cols.values())]
+        for name, cols in columns.items()
+    }
+    return spec
+
+
+def entry_path(directory, key):
+    """Path of the stored spec for key, e.g. ('county', 'Virginia', 'Fairfax County')."""
+    parts = [str(p).replace('/', '_') for p in key]
+    return os.path.join(directory, *parts[:-1], parts[-1] + '.json.gz')
+
+
+def render(key):
+    """Renders the spec dict for a key with the worker's loaders."""
+    if key[0] == 'country':
+        return country_spec(*loaders, resolution)
+    if key[0] == 'state':
+        return state_spec(key[1], *loaders, resolution)
+    return county_spec(*key[1:], *loaders, resolution)
+
+
+def write_entry(directory, key, spec):
+    template, columns = split_spec(spec)
+    digest = hashlib.sha1(template.encode()).hexdigest()[:16]
+    template_path = os.path.join(directory, 'templates', digest + '.json')
+    if not os.path.exists(template_path):
+        write_atomic(template_path, template.encode())
+
+    body = json.dumps({'template': digest, 'datasets': columns}, separators = (',', ':'))
+    write_atomic(entry_path(directory, key), gzip.compress(body.encode()))
+
+
+def write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def init_worker(args):
+    global loaders, resolution
+    apple_path, google_path, case_path, cache_dir, resolution = args
+    loaders = (AppleDataLoader(apple_path, cache_dir),
+               GoogleDataLoader(google_path, cache_dir),
+               CaseDataLoader(case_path, cache_dir))
+
+
+def render_batch(directory, keys):
+    for key in keys:
+        write_entry(directory, key, render(key))
+    return len(keys)
+
+
+def all_keys(apple):
+    keys = [('country',)]
+    keys += [('state', s) for s in apple.get_state_list()]
+    keys += [('county',) + tuple(sc.split(', ', 1)) for sc in sorted(apple.get_state_county_combinations())]
+    return keys
+
+
+def build(apple, google, cases, directory = SPEC_DIR, resolution = 'daily', processes = None, batch = 50):
+    """Renders every pane for the loaders' data into directory; returns the count.
+
+    Panes are rendered with their default detail dates.
+    """
+    # build the frames (and frame cache) once here so workers only memory-map them
+    for loader, names in ((apple, ['us', 'states', 'counties']),
+                          (google, ['us', 'states', 'counties']),
+                          (cases, ['data', 'states', 'us'])):
+        for name in names:
+            getattr(loader, name)
+    keys = all_keys(apple)
+    batches = [keys[i:i + batch] for i in range(0, len(keys), batch)]
+    args = (apple.path, google.path, cases.path, apple.cache_dir, resolution)
+
+    with ProcessPoolExecutor(processes, initializer = init_worker, initargs = (args,)) as pool:
+        count = sum(pool.map(render_batch, [directory] * len(batches), batches))
+
+    write_atomic(os.path.join(directory, 'manifest.json'), json.dumps({
+        'sources': [apple.path, google.path, cases.path],
+        'key': frame_cache.source_key([apple.path, google.path, cases.path]),
+        'resolution': resolution,
+        'count': count,
+    }).encode())
+    return count
+
+
+class SpecStore():
+    """Read side of a built store, bound to the loaders it must match."""
+
+    def __init__(self, apple, google, cases, directory = SPEC_DIR, resolution = 'daily'):
+        self.loaders = (apple, google, cases)
+        self.directory = directory
+        self.resolution = resolution
+        manifest = os.path.join(directory, 'manifest.json')
+        self.manifest = {}
+        if os.path.isfile(manifest):
+            with open(manifest) as f:
+                self.manifest = json.load(f)
+
+    def current(self):
+        """True if the store was built from the loaders' current sources at this resolution."""
+        key = self.manifest.get('key')
+        return (key is not None and self.manifest.get('resolution') == self.resolution and
+                key == frame_cache.source_key([l.path for l in self.loaders]))
+
+    def get(self, key):
+        """Returns the stored spec dict for key, or None if missing or stale."""
+        path = entry_path(self.directory, key)
+        if not self.current() or not os.path.isfile(path):
+            return None
+        return memo.cache.get_or_set(('spec_store', path, os.path.getmtime(path)), lambda: self.read(path))
+
+    def read(self, path):
+        with gzip.open(path, 'rt') as f:
+            entry = json.load(f)
+        with open(os.path.join(self.directory, 'templates', entry['template'] + '.json')) as f:
+            template = f.read()
+        return join_spec(template, entry['datasets'])
+
+
+if __name__ == '__main__':
+    directory = sys.argv[1] if len(sys.argv) > 1 else SPEC_DIR
+    resolution = sys.argv[2] if len(sys.argv) > 2 else 'daily'
+    n = build(AppleDataLoader(), GoogleDataLoader(), CaseDataLoader(), directory, resolution)
+    print(f'{n} {resolution} specs written to {directory}')
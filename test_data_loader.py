@@ -0,0 +1,154 @@
+"""Checks the vectorized per-region helpers against the pandas groupby versions,
+and loaders updated with a newer release against ones built from it.
+
+Run with: python -m pytest
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks import make_synthetic
+from data_loader import (AppleDataLoader, CaseDataLoader, GoogleDataLoader, diff, frames_cached,
+                         rolling_mean, sort_regions)
+
+
+def regions_frame(lengths, seed = 0, missing = 0.1):
+    """Region-sorted frame with one region per entry of lengths, and NaNs
+    scattered through its value columns."""
+    rng = np.random.default_rng(seed)
+    n = sum(lengths)
+    df = pd.DataFrame({
+        'state': np.repeat([f'S{i // 3}' for i in range(len(lengths))], lengths),
+        'county': np.repeat([f'C{i % 3}' for i in range(len(lengths))], lengths),
+        'date': np.concatenate([pd.date_range('2020-03-01', periods = k) for k in lengths]),
+        'a': rng.normal(100, 20, n),
+        'b': rng.poisson(5, n).astype(float),
+    })
+    for col in ['a', 'b']:
+        df.loc[rng.random(n) < missing, col] = np.nan
+    return sort_regions(df, ['state', 'county'])
+
+
+# region lengths: shorter than, equal to and longer than the windows, and single rows
+LENGTHS = [1, 3, 7, 8, 30, 2, 15, 6, 40]
+
+
+def expected_rolling(df, columns, keys, window):
+    if not keys:
+        return df[columns].rolling(window).mean().to_numpy()
+    res = df.groupby(keys, sort = False)[columns].rolling(window).mean()
+    return res.reset_index(level = list(range(len(keys))), drop = True).loc[df.index].to_numpy()
+
+
+def expected_diff(df, column, keys):
+    if not keys:
+        return df[column].diff().to_numpy()
+    return df.groupby(keys, sort = False)[column].diff().to_numpy()
+
+
+@pytest.mark.parametrize('window', [1, 3, 7, 14])
+@pytest.mark.parametrize('keys', [[], ['state'], ['state', 'county']])
+def test_rolling_mean_matches_pandas(keys, window):
+    df = sort_regions(regions_frame(LENGTHS), keys)
+    res = rolling_mean(df, ['a', 'b'], keys, window)
+    assert res.dtype == np.float32
+    np.testing.assert_allclose(res, expected_rolling(df, ['a', 'b'], keys, window), rtol = 1e-5, equal_nan = True)
+
+
+def test_rolling_mean_nan_inside_window():
+    df = pd.DataFrame({'state': ['S'] * 10, 'a': [1, 2, 3, np.nan, 5, 6, 7, 8, 9, 10.0]})
+    res = rolling_mean(df, ['a'], ['state'], window = 3)[:, 0]
+    # NaN until the window is full, and in every window holding row 3, as in pandas
+    expected = [np.nan, np.nan, 2, np.nan, np.nan, np.nan, 6, 7, 8, 9]
+    np.testing.assert_allclose(res, expected, equal_nan = True)
+
+
+def test_rolling_mean_short_regions():
+    df = regions_frame([2, 3, 1], missing = 0)
+    assert np.isnan(rolling_mean(df, ['a'], ['state', 'county'], window = 4)).all()
+
+
+@pytest.mark.parametrize('keys', [[], ['state'], ['state', 'county']])
+def test_diff_matches_pandas(keys):
+    df = sort_regions(regions_frame(LENGTHS, seed = 1), keys)
+    res = diff(df, 'b', keys)
+    assert res.dtype == np.float32
+    np.testing.assert_allclose(res, expected_diff(df, 'b', keys), equal_nan = True)
+
+
+def test_diff_region_boundaries():
+    df = regions_frame([3, 1, 4], missing = 0)
+    res = diff(df, 'a', ['state', 'county'])
+    starts = [0, 3, 4]
+    assert np.isnan(res[starts]).all()
+    assert not np.isnan(np.delete(res, starts)).any()
+
+
+LEVELS = {
+    AppleDataLoader: ['all_data', 'us', 'states', 'counties', 'cities', 'state_index', 'county_index'],
+    GoogleDataLoader: ['all_data', 'us', 'states', 'counties', 'state_index', 'county_index'],
+    CaseDataLoader: ['data', 'us', 'states', 'state_index', 'county_index'],
+}
+
+# days in the full synthetic files, and how many the truncated releases lack
+DAYS, NEW_DAYS = 40, 9
+
+
+def truncate(paths, directory):
+    """Copies of the synthetic files without their last NEW_DAYS days."""
+    res = {s: str(directory / f'{s}.csv') for s in paths}
+    for source in ('apple', 'cases'):
+        wide = pd.read_csv(paths[source])
+        wide.iloc[:, :-NEW_DAYS].to_csv(res[source], index = False)
+    google = pd.read_csv(paths['google'])
+    last = sorted(google['date'].unique())[-NEW_DAYS - 1]
+    google[google['date'] <= last].to_csv(res['google'], index = False)
+    return res
+
+
+def assert_level_equal(name, got, expected):
+    if isinstance(expected, dict):
+        assert got == expected, name
+        return
+    # row labels carry no meaning, but Google's frames are indexed by date
+    got, expected = (df.reset_index(drop = df.index.name is None) for df in (got, expected))
+    if name == 'all_data':
+        # update() appends new rows at the end rather than in file order
+        by = [c for c in ['geo_type', 'sub-region', 'region', 'transportation_type', 'sub_region_1', 'sub_region_2']
+              if c in expected]
+        got, expected = (df.sort_values(by + ['date'], kind = 'mergesort').reset_index(drop = True)
+                         for df in (got, expected))
+    pd.testing.assert_frame_equal(got, expected, check_categorical = False, check_index_type = False,
+                                  rtol = 1e-5, obj = name)
+
+
+@pytest.fixture(scope = 'module')
+def releases(tmp_path_factory):
+    """(full, truncated) synthetic source paths."""
+    directory = tmp_path_factory.mktemp('releases')
+    full = make_synthetic(str(directory), states = 4, counties = 3, days = DAYS)
+    (directory / 'truncated').mkdir()
+    return full, truncate(full, directory / 'truncated')
+
+
+@pytest.mark.parametrize('cls', LEVELS, ids = lambda cls: cls.__name__)
+def test_update_matches_fresh_build(tmp_path, releases, cls):
+    full, truncated = releases
+    source = {AppleDataLoader: 'apple', GoogleDataLoader: 'google', CaseDataLoader: 'cases'}[cls]
+    cache_dir = str(tmp_path / 'cache')
+    loader = cls(truncated[source], cache_dir = cache_dir)
+    for name in LEVELS[cls]:
+        getattr(loader, name)
+
+    assert loader.update(full[source])
+    assert (loader.path, loader.version) == (full[source], 1)
+    assert not loader.update(full[source])
+
+    # the updated frames were written to the frame cache under the new release
+    assert frames_cached(loader, LEVELS[cls])
+    reloaded = cls(full[source], cache_dir = cache_dir)
+    fresh = cls(full[source], cache_dir = None)
+    for name in LEVELS[cls]:
+        expected = getattr(fresh, name)
+        assert_level_equal(name, getattr(loader, name), expected)
+        assert_level_equal(name, getattr(reloaded, name), expected)
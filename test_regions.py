@@ -0,0 +1,100 @@
+"""Checks RegionStore's joined rows against the per-loader getters on synthetic data.
+
+Run with: python -m pytest
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks import make_synthetic
+from data_loader import DESTINATIONS, AppleDataLoader, CaseDataLoader, GoogleDataLoader
+from regions import RegionStore, county_code
+
+
+@pytest.fixture(scope = 'module')
+def loaders(tmp_path_factory):
+    paths = make_synthetic(str(tmp_path_factory.mktemp('sources')), states = 4, counties = 3, days = 40)
+    return (AppleDataLoader(paths['apple'], cache_dir = None),
+            GoogleDataLoader(paths['google'], cache_dir = None),
+            CaseDataLoader(paths['cases'], cache_dir = None))
+
+
+@pytest.fixture(scope = 'module')
+def store(loaders):
+    return RegionStore(*loaders)
+
+
+def assert_joined(joined, source, columns):
+    """joined's columns equal the source's (renamed per columns) on the source's
+    dates, and are NaN on the other dates."""
+    expected = source.set_index('date')
+    for col, source_col in columns.items():
+        got = joined.set_index('date')[col]
+        np.testing.assert_allclose(got.to_numpy(), expected[source_col].reindex(got.index).to_numpy(),
+                                   rtol = 1e-6, equal_nan = True, err_msg = col)
+
+
+def test_states_match_loaders(loaders, store):
+    apple, google, cases = loaders
+    res = store.get_states(['State 2', 'State 0'])
+    assert res['state'].unique().tolist() == ['State 2', 'State 0']
+    assert res['fips'].unique().tolist() == [3, 1]
+    for state in ['State 2', 'State 0']:
+        joined = res[res['state'] == state]
+        # every region has a row for every date in any source
+        assert joined['date'].is_monotonic_increasing and len(joined) == len(store.level('states')[2])
+        assert_joined(joined, apple.get_state(state), {'driving': 'driving', 'driving_7_day': '7_day'})
+        assert_joined(joined, google.get_state_wide(state),
+                      {c: c for c in DESTINATIONS + [d + '_7_day' for d in DESTINATIONS]})
+        assert_joined(joined, cases.get_state(state), {c: c for c in ['cases', 'new_cases', 'new_cases_7_day']})
+
+
+def test_counties_match_loaders(loaders, store):
+    apple, google, cases = loaders
+    counties = [('State 1', 'County 2 County'), ('State 3', 'County 0 County')]
+    res = store.get_counties(counties)
+    assert res['fips'].unique().tolist() == [2003, 4001]
+    for state, county in counties:
+        joined = res[(res['state'] == state) & (res['county'] == county)]
+        assert_joined(joined, apple.get_county(state, county), {'driving': 'driving', 'driving_7_day': '7_day'})
+        assert_joined(joined, google.get_county_wide(state, county), {c: c for c in DESTINATIONS})
+        # JHU's 'County 2' is mapped by dropping the suffix of Apple's and Google's name
+        assert_joined(joined, cases.get_county(state, county),
+                      {c: c for c in ['cases', 'new_cases', 'new_cases_7_day']})
+
+
+def test_county_names_from_later_sources(store):
+    regions = store.level('counties')[1]
+    assert (regions['county'].str.endswith(' County')).all()
+    # JHU's own names are replaced by Apple's, so they are not looked up
+    assert store.get_counties([('State 1', 'County 2')]).empty
+
+
+def test_unknown_names_skipped(store):
+    res = store.get_states(['Atlantis', 'State 1', 'State 9'])
+    assert res['state'].unique().tolist() == ['State 1']
+    assert store.get_states([]).empty
+    assert store.get_counties([('State 1', 'County 9 County'), ('Atlantis', 'County 0 County')]).empty
+
+
+def test_dates_clipped(loaders, store):
+    res = store.get_states(['State 0', 'State 1'], metrics = ['cases'], dates = ('2020-02-01', '2020-02-10'))
+    assert res.columns.tolist() == ['fips', 'state', 'date', 'cases']
+    dates = pd.date_range('2020-02-01', '2020-02-10')
+    assert (res['date'].to_numpy() == np.tile(dates.to_numpy(), 2)).all()
+    # a range past the data is cut to the dates that exist
+    last = store.level('states')[2][-1]
+    res = store.get_states(['State 0'], dates = (last - np.timedelta64(2, 'D'), '2030-01-01'))
+    assert len(res) == 3 and res['date'].max() == last
+
+
+@pytest.mark.parametrize('county, code', [
+    ('Fairfax County', 51059),       # suffix dropped
+    ('Baltimore City', 24510),       # JHU keeps the suffix
+    ('Acadia Parish', 22001),
+    ('Fairfax', 51059),
+    ('Arlington County', 0),
+])
+def test_county_code(county, code):
+    codes = {('S', 'Fairfax'): 51059, ('S', 'Baltimore City'): 24510, ('S', 'Acadia'): 22001}
+    assert county_code(codes, 'S', county) == code
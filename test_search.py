@@ -0,0 +1,59 @@
+"""Pins NameIndex's ranking: exact, prefix, later-word prefix, then fuzzy matches,
+with ties going to the shorter name, then alphabetically.
+
+Run with: python -m pytest
+"""
+import pytest
+
+import search
+from search import NameIndex
+
+NAMES = ['Kent', 'Keno', 'Kenton', 'Kentucky', 'Kent County', 'North Kent', 'Lake Kenton', 'Tent', 'Ohio']
+
+
+@pytest.fixture
+def index():
+    return NameIndex(NAMES)
+
+
+def test_exact_then_prefix_then_later_word(index):
+    # exact; prefixes by length; later-word prefixes by length
+    assert index.search('kent') == ['Kent', 'Kenton', 'Kentucky', 'Kent County', 'North Kent', 'Lake Kenton']
+
+
+def test_ties_by_length_then_alphabetically(index):
+    assert index.search('ken') == ['Keno', 'Kent', 'Kenton', 'Kentucky', 'Kent County', 'North Kent', 'Lake Kenton']
+
+
+def test_fuzzy_after_prefix_matches(index):
+    # 'Kent', 'Kentucky' and 'Kent County' share 4 of the query's 6 trigrams;
+    # 'Keno' and 'North Kent' (whose 'Kent' starts no name) 3
+    assert index.search('kento') == ['Kenton', 'Lake Kenton', 'Kent', 'Kentucky', 'Kent County', 'Keno',
+                                     'North Kent']
+
+
+def test_fuzzy_finds_typos(index):
+    assert index.search('kentuky')[0] == 'Kentucky'
+    assert index.search('xyz') == []
+
+
+def test_exact_match_skips_fuzzy(index):
+    assert index.search('kent county') == ['Kent County']
+
+
+def test_case_and_punctuation_insensitive(index):
+    assert index.search('  NORTH-kent ') == ['North Kent']
+    assert index.search('') == index.search(', ') == []
+
+
+def test_limit(index):
+    assert index.search('kent', limit = 2) == ['Kent', 'Kenton']
+    assert index.search('kento', limit = 3) == ['Kenton', 'Lake Kenton', 'Kent']
+
+
+def test_common_trigrams_ignored(monkeypatch):
+    assert NameIndex(NAMES).search('kentx')
+    # ' ke', 'ken', 'ent' ... are in more than 2 names: only the query's
+    # other trigrams count, and no name has them
+    monkeypatch.setattr(search, 'MAX_POSTINGS', 2)
+    assert NameIndex(NAMES).search('kentx') == []
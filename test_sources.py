@@ -0,0 +1,100 @@
+"""Snapshot refreshes against a local stand-in for the remote host (serve_directory).
+
+Run with: python -m pytest
+"""
+import os
+import urllib.error
+
+import pytest
+
+import sources
+from sources import SnapshotSource, serve_directory
+
+
+@pytest.fixture
+def remote(tmp_path):
+    """A served directory holding data.csv; yields (directory, file URL)."""
+    directory = tmp_path / 'remote'
+    directory.mkdir()
+    (directory / 'data.csv').write_text('a,b\n1,2\n')
+    server, url = serve_directory(str(directory))
+    yield directory, url + '/data.csv'
+    server.shutdown()
+    server.server_close()
+
+
+def source(tmp_path, url):
+    return SnapshotSource(url, 'data', directory = str(tmp_path / 'snapshots'))
+
+
+def test_first_fetch(tmp_path, remote):
+    _, url = remote
+    s = source(tmp_path, url)
+    assert s.latest() is None
+    path = s.path
+    assert s.snapshots() == [path]
+    with open(path) as f:
+        assert f.read() == 'a,b\n1,2\n'
+    assert s.manifest()['etag'] and s.manifest()['last_modified']
+
+
+def test_unchanged_file_is_not_downloaded_again(tmp_path, remote):
+    _, url = remote
+    s = source(tmp_path, url)
+    first = s.refresh()
+    # answered with 304 Not Modified: no new snapshot
+    assert s.refresh() == first
+    assert s.snapshots() == [first]
+
+
+def test_changed_file_gives_new_snapshot(tmp_path, remote):
+    directory, url = remote
+    s = source(tmp_path, url)
+    first = s.refresh()
+    remote_file = directory / 'data.csv'
+    remote_file.write_text('a,b\n1,2\n3,4\n')
+    st = os.stat(remote_file)
+    os.utime(remote_file, ns = (st.st_atime_ns, st.st_mtime_ns + 10**10))
+
+    second = s.refresh()
+    assert second != first
+    assert s.snapshots() == [first, second]
+    with open(second) as f:
+        assert f.read() == 'a,b\n1,2\n3,4\n'
+
+
+def test_old_snapshots_are_pruned(tmp_path, remote):
+    directory, url = remote
+    s = SnapshotSource(url, 'data', directory = str(tmp_path / 'snapshots'), keep = 2)
+    remote_file = directory / 'data.csv'
+    for i in range(3):
+        remote_file.write_text(f'a\n{i}\n')
+        os.utime(remote_file, ns = (10**18 + i * 10**10,) * 2)
+        s.refresh()
+    assert len(s.snapshots()) == 2
+    with open(s.latest()) as f:
+        assert f.read() == 'a\n2\n'
+
+
+def test_offline_reads_newest_snapshot(tmp_path, remote):
+    _, url = remote
+    fetched = source(tmp_path, url).refresh()
+    offline = source(tmp_path, 'http://127.0.0.1:9/data.csv')
+    # path never touches the network once a snapshot exists
+    assert offline.path == fetched
+    with pytest.raises(urllib.error.URLError):
+        offline.refresh(timeout = 5)
+
+
+def test_failed_download_leaves_no_scratch_file(tmp_path, remote, monkeypatch):
+    _, url = remote
+
+    def cut_off(response, f):
+        f.write(response.read(2))
+        raise ConnectionResetError('connection lost')
+
+    monkeypatch.setattr(sources.shutil, 'copyfileobj', cut_off)
+    s = source(tmp_path, url)
+    with pytest.raises(ConnectionResetError):
+        s.refresh()
+    assert os.listdir(s.directory) == []